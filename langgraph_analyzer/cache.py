@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""
+Caches for the Subsidy Analyzer
+===============================
+
+This module contains the on-disk caches used to avoid repeating work
+(API calls, downloads, text extraction, LLM calls) across analyzer runs.
+"""
+
+import os
+import time
+import sqlite3
+import functools
+import hashlib
+from contextlib import closing
+from pathlib import Path
+from typing import Dict, Any, List, Optional
+
+from langgraph_analyzer.utils import dumps_json, loads_json, write_json_file
+
+
+# Directory holding all cache entries
+CACHE_DIR = Path(os.getenv("SUBSIDY_CACHE_DIR", "cache"))
+
+# SQLite database holding LLM responses
+LLM_CACHE_PATH = CACHE_DIR / "llm_responses.sqlite"
+
+# Set DISABLE_CACHE=1 (e.g. in CI) to always hit the network and the LLM
+CACHE_ENABLED = os.getenv("DISABLE_CACHE", "").lower() not in ("1", "true", "yes")
+
+# Age (seconds) below which a cached API response is used without revalidating it
+API_CACHE_TTL = 24 * 60 * 60
+
+# Bump whenever the prompts change meaning, so responses to old prompts are not reused
+PROMPT_VERSION = "v1"
+
+# Lifetime (seconds) of a cached LLM response
+LLM_CACHE_TTL = 7 * 24 * 60 * 60
+
+
+@functools.lru_cache(maxsize=None)
+def _ensure_cache_dir() -> Path:
+    """Create the cache directory (once per process)."""
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    return CACHE_DIR
+
+
+def pdf_cache_key(bdns_code: str, doc_id: Any) -> str:
+    """Build the cache key of a subsidy document."""
+    return hashlib.sha256(f"{bdns_code}:{doc_id}".encode()).hexdigest()
+
+
+def _pdf_cache_paths(key: str):
+    """Return the extracted-text and metadata paths of a cache entry."""
+    return CACHE_DIR / f"{key}.txt", CACHE_DIR / f"{key}.json"
+
+
+def load_cached_api_response(bdns_code: str) -> Optional[Dict[str, Any]]:
+    """
+    Load the cached API response of a subsidy.
+
+    Returns:
+        Dict with data, etag, last_modified and fetched_at, or None on a cache miss
+    """
+    if not CACHE_ENABLED:
+        return None
+
+    try:
+        return loads_json((CACHE_DIR / f"api_{bdns_code}.json").read_bytes())
+    except (OSError, ValueError):
+        return None
+
+
+def store_cached_api_response(bdns_code: str, data: Dict[str, Any],
+                              etag: Optional[str] = None, last_modified: Optional[str] = None) -> None:
+    """Store the API response of a subsidy together with its HTTP validators."""
+    if not CACHE_ENABLED:
+        return
+
+    try:
+        _ensure_cache_dir()
+        write_json_file(CACHE_DIR / f"api_{bdns_code}.json", {
+            'data': data,
+            'etag': etag,
+            'last_modified': last_modified,
+            'fetched_at': time.time()
+        })
+    except OSError:
+        pass  # A failed cache write must never fail the analysis
+
+
+def load_cached_pdf(bdns_code: str, doc_id: Any) -> Optional[Dict[str, Any]]:
+    """
+    Load a cached PDF entry.
+
+    Returns:
+        Dict with text, path, etag and last_modified, or None when the entry
+        is missing or the saved PDF no longer exists
+    """
+    if not CACHE_ENABLED:
+        return None
+
+    txt_path, meta_path = _pdf_cache_paths(pdf_cache_key(bdns_code, doc_id))
+    if not (txt_path.exists() and meta_path.exists()):
+        return None
+
+    try:
+        metadata = loads_json(meta_path.read_bytes())
+        if not Path(metadata['path']).exists():
+            return None
+        metadata['text'] = txt_path.read_text(encoding='utf-8')
+        return metadata
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def store_cached_pdf(bdns_code: str, doc_id: Any, text: str, pdf_path: Path,
+                     etag: Optional[str] = None, last_modified: Optional[str] = None) -> None:
+    """Store the extracted text and HTTP validators of a downloaded PDF."""
+    if not CACHE_ENABLED:
+        return
+
+    txt_path, meta_path = _pdf_cache_paths(pdf_cache_key(bdns_code, doc_id))
+
+    try:
+        _ensure_cache_dir()
+        txt_path.write_text(text, encoding='utf-8')
+        # Metadata is written last: an entry only counts as cached once it exists
+        write_json_file(meta_path, {
+            'path': str(pdf_path),
+            'etag': etag,
+            'last_modified': last_modified
+        })
+    except OSError:
+        pass  # A failed cache write must never fail the analysis
+
+
+def llm_cache_key(model_name: str, *contents: str) -> str:
+    """Build the exact-match cache key of an LLM request (model, prompt version and message contents)."""
+    digest = hashlib.sha256()
+    for part in (model_name, PROMPT_VERSION, *contents):
+        digest.update(part.encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def _llm_cache_connection() -> sqlite3.Connection:
+    """Open the LLM response cache, creating it if needed."""
+    _ensure_cache_dir()
+    connection = sqlite3.connect(LLM_CACHE_PATH, timeout=30)
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS llm_responses ("
+        "key TEXT PRIMARY KEY, content TEXT NOT NULL, token_usage TEXT, "
+        "prompt_version TEXT NOT NULL, expires_at REAL NOT NULL)"
+    )
+    return connection
+
+
+def load_cached_response(key: str) -> Optional[Dict[str, Any]]:
+    """
+    Load a cached LLM response.
+
+    Returns:
+        Dict with content and token_usage, or None on a cache miss or expired entry
+    """
+    if not CACHE_ENABLED:
+        return None
+
+    try:
+        with closing(_llm_cache_connection()) as connection:
+            row = connection.execute(
+                "SELECT content, token_usage FROM llm_responses WHERE key = ? AND expires_at > ?",
+                (key, time.time())
+            ).fetchone()
+    except sqlite3.Error:
+        return None
+
+    if row is None:
+        return None
+    return {'content': row[0], 'token_usage': loads_json(row[1]) if row[1] else []}
+
+
+def store_cached_response(key: str, content: str, token_usage: List[Dict[str, Any]],
+                          ttl: float = LLM_CACHE_TTL) -> None:
+    """Store an LLM response in the cache for ttl seconds."""
+    if not CACHE_ENABLED:
+        return
+
+    try:
+        with closing(_llm_cache_connection()) as connection, connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO llm_responses "
+                "(key, content, token_usage, prompt_version, expires_at) VALUES (?, ?, ?, ?, ?)",
+                (key, content, dumps_json(token_usage), PROMPT_VERSION, time.time() + ttl)
+            )
+    except sqlite3.Error:
+        pass  # A failed cache write must never fail the analysis
+
+
+def invalidate_llm_cache(prompt_version: Optional[str] = None) -> int:
+    """
+    Drop cached LLM responses.
+
+    Args:
+        prompt_version: Only drop responses stored under this prompt version
+            (all responses when None)
+
+    Returns:
+        Number of responses removed
+    """
+    try:
+        with closing(_llm_cache_connection()) as connection, connection:
+            if prompt_version is None:
+                cursor = connection.execute("DELETE FROM llm_responses")
+            else:
+                cursor = connection.execute(
+                    "DELETE FROM llm_responses WHERE prompt_version = ?", (prompt_version,)
+                )
+            return cursor.rowcount
+    except sqlite3.Error:
+        return 0
@@ -7,13 +7,16 @@ This module defines the main LangGraph workflow.
 """
 
 import time
-from typing import Dict, Any
+import asyncio
+from typing import Dict, Any, List
+from concurrent.futures import ThreadPoolExecutor
 import sys
 import os
-from pathlib import Path
 
-# Add the parent directory to the path for absolute imports
-sys.path.insert(0, str(Path(__file__).parent.parent))
+# Add the parent directory to the path for absolute imports (once, whichever module runs first)
+_PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if _PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, _PROJECT_ROOT)
 
 # Use simplified LLM for LangGraph project
 from langgraph_analyzer.simple_llms import SimpleLLM as LanguageModel
@@ -23,17 +26,19 @@ from langsmith import traceable
 
 from langgraph_analyzer.schemas import SubsidyState
 from langgraph_analyzer.nodes import (
-    extract_bdns_node,
-    fetch_subsidy_info_node, 
-    find_pdf_urls_node,
+    prepare_node,
     download_pdfs_node,
-    analyze_subsidy_node,
-    save_results_node
+    analyze_and_save_node,
+    analyze_subsidy_batch,
+    MAX_SUBSIDIES_PER_BATCH
 )
 from langgraph_analyzer.utils import setup_logging
 
 logger = setup_logging()
 
+# Default number of subsidy workflows (and so LLM requests) in flight at once in a batch
+BATCH_MAX_CONCURRENCY = 4
+
 
 class SubsidyAnalyzerGraph:
     """
@@ -58,29 +63,23 @@ class SubsidyAnalyzerGraph:
         """Build the LangGraph workflow."""
         workflow = StateGraph(SubsidyState)
         
-        # Add nodes
-        workflow.add_node("extract_bdns", extract_bdns_node)
-        workflow.add_node("fetch_subsidy_info", fetch_subsidy_info_node)
-        workflow.add_node("find_pdf_urls", find_pdf_urls_node)
+        # Add nodes (sequential steps are fused to avoid per-node scheduling and tracing overhead)
+        workflow.add_node("prepare", prepare_node)
         workflow.add_node("download_pdfs", download_pdfs_node)
-        workflow.add_node("analyze_subsidy", self._create_analyze_node())
-        workflow.add_node("save_results", save_results_node)
+        workflow.add_node("analyze_and_save", self._create_analyze_node())
         
         # Define the flow
-        workflow.set_entry_point("extract_bdns")
-        workflow.add_edge("extract_bdns", "fetch_subsidy_info")
-        workflow.add_edge("fetch_subsidy_info", "find_pdf_urls")
-        workflow.add_edge("find_pdf_urls", "download_pdfs")
-        workflow.add_edge("download_pdfs", "analyze_subsidy")
-        workflow.add_edge("analyze_subsidy", "save_results")
-        workflow.add_edge("save_results", END)
+        workflow.set_entry_point("prepare")
+        workflow.add_edge("prepare", "download_pdfs")
+        workflow.add_edge("download_pdfs", "analyze_and_save")
+        workflow.add_edge("analyze_and_save", END)
         
         return workflow.compile()
     
     def _create_analyze_node(self):
         """Create the analyze node with LLM dependency injection."""
         def analyze_with_llm(state: SubsidyState) -> SubsidyState:
-            return analyze_subsidy_node(state, self.llm)
+            return analyze_and_save_node(state, self.llm)
         return analyze_with_llm
     
     @traceable(name="analyze_subsidy_from_bdns")
@@ -123,7 +122,7 @@ class SubsidyAnalyzerGraph:
         
         try:
             # Run the workflow
-            logger.info(f"Starting analysis for BDNS code: {bdns_code}")
+            logger.info("Starting analysis for BDNS code: %s", bdns_code)
             final_state = self.workflow.invoke(initial_state, config)
             
             # Calculate processing time
@@ -131,12 +130,12 @@ class SubsidyAnalyzerGraph:
             final_state["processing_time"] = processing_time
             
             # Log results
-            logger.info(f"Workflow completed for BDNS {bdns_code} in {processing_time:.2f}s")
+            logger.info("Workflow completed for BDNS %s in %.2fs", bdns_code, processing_time)
             for log in final_state.get("logs", []):
-                logger.info(f"  - {log}")
+                logger.info("  - %s", log)
             
             if final_state.get("error"):
-                logger.error(f"Workflow error: {final_state['error']}")
+                logger.error("Workflow error: %s", final_state['error'])
             
             return {
                 "success": not bool(final_state.get("error")),
@@ -150,7 +149,7 @@ class SubsidyAnalyzerGraph:
             
         except Exception as e:
             processing_time = time.time() - start_time
-            logger.error(f"Workflow failed for BDNS {bdns_code}: {e}")
+            logger.error("Workflow failed for BDNS %s: %s", bdns_code, e)
             return {
                 "success": False,
                 "analysis_result": None,
@@ -161,6 +160,36 @@ class SubsidyAnalyzerGraph:
                 "error": str(e)
             }
     
+    @traceable(name="analyze_subsidies_from_bdns")
+    def analyze_batch(self, bdns_codes: List[str], max_concurrency: int = BATCH_MAX_CONCURRENCY) -> List[Dict[str, Any]]:
+        """
+        Analyze several subsidies from their BDNS codes concurrently.
+        
+        Each subsidy runs the full workflow (API, PDFs and LLM); up to
+        max_concurrency workflows, and so LLM requests, are in flight at once.
+        
+        Args:
+            bdns_codes: BDNS codes of the subsidies
+            max_concurrency: Maximum number of subsidies analyzed at the same time
+            
+        Returns:
+            One analysis result per BDNS code, in input order
+        """
+        if not bdns_codes:
+            return []
+        
+        with ThreadPoolExecutor(max_workers=min(max_concurrency, len(bdns_codes))) as pool:
+            return list(pool.map(self.analyze_from_bdns, bdns_codes))
+    
+    async def aanalyze_from_bdns(self, bdns_code: str) -> Dict[str, Any]:
+        """Async variant of analyze_from_bdns; the workflow runs in a worker thread."""
+        return await asyncio.to_thread(self.analyze_from_bdns, bdns_code)
+    
+    async def aanalyze_batch(self, bdns_codes: List[str],
+                             max_concurrency: int = BATCH_MAX_CONCURRENCY) -> List[Dict[str, Any]]:
+        """Async variant of analyze_batch for callers running an event loop; the batch runs in a worker thread."""
+        return await asyncio.to_thread(self.analyze_batch, bdns_codes, max_concurrency)
+    
     @traceable(name="analyze_subsidy_from_data")
     def analyze_from_data(self, subsidy_data: Dict[str, Any]) -> Dict[str, Any]:
         """
@@ -216,7 +245,7 @@ class SubsidyAnalyzerGraph:
         
         try:
             # Run the workflow
-            logger.info(f"Starting analysis from data for BDNS: {bdns_code}")
+            logger.info("Starting analysis from data for BDNS: %s", bdns_code)
             final_state = self.workflow.invoke(initial_state, config)
             
             # Calculate processing time
@@ -224,12 +253,12 @@ class SubsidyAnalyzerGraph:
             final_state["processing_time"] = processing_time
             
             # Log results
-            logger.info(f"Workflow completed in {processing_time:.2f}s")
+            logger.info("Workflow completed in %.2fs", processing_time)
             for log in final_state.get("logs", []):
-                logger.info(f"  - {log}")
+                logger.info("  - %s", log)
             
             if final_state.get("error"):
-                logger.error(f"Workflow error: {final_state['error']}")
+                logger.error("Workflow error: %s", final_state['error'])
             
             return {
                 "success": not bool(final_state.get("error")),
@@ -243,7 +272,7 @@ class SubsidyAnalyzerGraph:
             
         except Exception as e:
             processing_time = time.time() - start_time
-            logger.error(f"Workflow failed: {e}")
+            logger.error("Workflow failed: %s", e)
             return {
                 "success": False,
                 "analysis_result": None,
@@ -254,6 +283,52 @@ class SubsidyAnalyzerGraph:
                 "error": str(e)
             }
     
+    @traceable(name="analyze_subsidies_batch")
+    def analyze_subsidies_batch(self, subsidies: List[Dict[str, Any]], batch_size: int = 4) -> List[Dict[str, Any]]:
+        """
+        Analyze several subsidies from existing data, packing up to batch_size
+        of them (at most MAX_SUBSIDIES_PER_BATCH, so the answers fit the output
+        token limit) into each LLM call.
+        
+        PDFs are not downloaded in this mode; each analysis is based on the
+        subsidy data only (same as analyze_from_data when no PDFs are found).
+        
+        Args:
+            subsidies: List of subsidy data dictionaries
+            batch_size: Maximum number of subsidies sent in one LLM call
+            
+        Returns:
+            One analysis result per subsidy, in input order
+        """
+        results = []
+        batch_size = max(1, min(batch_size, MAX_SUBSIDIES_PER_BATCH))
+        
+        for offset in range(0, len(subsidies), batch_size):
+            batch = subsidies[offset:offset + batch_size]
+            start_time = time.time()
+            
+            try:
+                analyses = analyze_subsidy_batch(batch, self.llm)
+            except Exception as e:
+                logger.error("Batch analysis failed: %s", e)
+                analyses = [{"analysis_result": None, "raw_analysis": None, "error": str(e)} for _ in batch]
+            
+            processing_time = time.time() - start_time
+            logger.info("Batch of %d subsidies analyzed in %.2fs", len(batch), processing_time)
+            
+            for analysis in analyses:
+                results.append({
+                    "success": not analysis["error"],
+                    "analysis_result": analysis["analysis_result"],
+                    "raw_analysis": analysis["raw_analysis"],
+                    "processing_time": processing_time,
+                    "pdf_count": 0,
+                    "logs": [f"Analyzed in a batch of {len(batch)} subsidies"],
+                    "error": analysis["error"]
+                })
+        
+        return results
+    
     @traceable(name="analyze_subsidy_from_url")
     def analyze_from_url(self, url: str) -> Dict[str, Any]:
         """
@@ -6,43 +6,268 @@ Nodes for the Subsidy Analyzer LangGraph
 This module contains all the node functions for the LangGraph workflow.
 """
 
-import json
+import os
+import copy
 import time
+import atexit
+import hashlib
+import tempfile
+import functools
+import threading
 import requests
-import PyPDF2
-import io
-from typing import Dict, Any
+from string import Template
+from typing import Dict, Any, Iterator, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 from datetime import datetime
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.chrome.service import Service
-from webdriver_manager.chrome import ChromeDriverManager
+from urllib.parse import urljoin, urlparse, unquote
 import sys
-from pathlib import Path
 
-# Add the parent directory to the path for absolute imports
-sys.path.insert(0, str(Path(__file__).parent.parent))
+# Add the parent directory to the path for absolute imports (once, whichever module runs first)
+_PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if _PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, _PROJECT_ROOT)
 
 from langchain_core.messages import HumanMessage, SystemMessage
 # Use simplified LLM for LangGraph project
-from langgraph_analyzer.simple_llms import SimpleLLM as LanguageModel
+from langgraph_analyzer.simple_llms import SimpleLLM as LanguageModel, MAX_OUTPUT_TOKENS
 from langsmith import traceable
 
 from langgraph_analyzer.schemas import SubsidyState, SubsidyAnalysisResult
-from langgraph_analyzer.prompts import SYSTEM_PROMPT, ANALYSIS_PROMPT_WITH_PDF, ANALYSIS_PROMPT_WITHOUT_PDF
+from langgraph_analyzer.cache import (
+    load_cached_api_response, store_cached_api_response, load_cached_pdf, store_cached_pdf,
+    API_CACHE_TTL
+)
+from langgraph_analyzer.prompts import (
+    SYSTEM_PROMPT, ANALYSIS_PROMPT_WITH_PDF, ANALYSIS_PROMPT_WITHOUT_PDF, BATCH_ANALYSIS_PROMPT
+)
 from langgraph_analyzer.utils import (
     extract_bdns_from_url, clean_filename, create_download_directory,
-    extract_json_from_text, get_api_headers, validate_pdf_content,
-    setup_logging
+    extract_json_from_text, create_http_session, validate_pdf_content, has_pdf_trailer,
+    extract_pdf_text, fit_pdf_texts_to_budget, dumps_json, loads_json, write_json_file, setup_logging,
+    PDF_TRAILER_WINDOW
 )
 
 # Setup logger
 logger = setup_logging()
 
+# Keys the BDNS API uses for a document's name and type, in order of preference
+DOC_NAME_KEYS = ('nombreFic', 'nombre', 'name')
+DOC_TYPE_KEYS = ('tipo', 'type')
+PDF_DOC_TYPES = frozenset({'PDF', 'pdf', 'application/pdf'})
+
+# Anchors pointing at PDF documents on a subsidy web page
+PDF_LINK_SELECTOR = 'a[href$=".pdf"], a[href*=".pdf?"]'
+
+# Maximum number of PDFs downloaded at the same time for one subsidy
+MAX_PDF_DOWNLOAD_WORKERS = 6
+
+# Output budget of one batch analysis call (gpt-4o/gpt-4o-mini return at most 16,384 tokens);
+# each subsidy in a batch gets the output budget of a single analysis
+BATCH_MAX_OUTPUT_TOKENS = 16_000
+MAX_SUBSIDIES_PER_BATCH = BATCH_MAX_OUTPUT_TOKENS // MAX_OUTPUT_TOKENS
+
+# Threads handing downloaded PDFs to the extraction process pool
+MAX_PDF_EXTRACTION_WORKERS = os.cpu_count() or 2
+
+# Size of the chunks streamed from the network to disk while downloading PDFs
+PDF_CHUNK_SIZE = 64 * 1024
+
+# Only fall back to a headless browser for JS-rendered pages when explicitly enabled
+USE_SELENIUM = os.getenv("USE_SELENIUM", "").lower() in ("1", "true", "yes")
+
+# Maximum time to wait for a JS-rendered page to show a PDF link
+SELENIUM_WAIT_SECONDS = 8
+
+# Analysis files are written off the workflow's critical path; pending writes finish at exit
+_IO_POOL = ThreadPoolExecutor(max_workers=2, thread_name_prefix="results-writer")
+atexit.register(_IO_POOL.shutdown, wait=True)
+
+# Keep-alive HTTP session shared by every node and workflow run in this process,
+# so repeated runs reuse pooled TCP/TLS connections instead of reconnecting
+_HTTP = create_http_session()
+
+# The system prompt never changes, so its message is built once and shared by every call
+_SYSTEM_MESSAGE = SystemMessage(content=SYSTEM_PROMPT)
+
+# Prompt templates, parsed once at import
+_PROMPT_WITH_PDF = Template(ANALYSIS_PROMPT_WITH_PDF)
+_PROMPT_WITHOUT_PDF = Template(ANALYSIS_PROMPT_WITHOUT_PDF)
+_BATCH_PROMPT = Template(BATCH_ANALYSIS_PROMPT)
+
+# State keys the graph merges with operator.add instead of overwriting (see SubsidyState)
+APPENDED_STATE_KEYS = frozenset({"logs", "pdf_texts"})
+
+# Long-lived headless browser shared by all Selenium fallbacks
+_webdriver = None
+_webdriver_lock = threading.Lock()
+
+
+def _run_steps(state: SubsidyState, *steps) -> Dict[str, Any]:
+    """
+    Run workflow steps in sequence within one graph node.
+    
+    Each step sees the updates of the previous ones; the combined partial
+    update is returned for LangGraph to merge into the state.
+    """
+    view = dict(state)
+    update: Dict[str, Any] = {}
+    for step in steps:
+        for key, value in step(view).items():
+            if key in APPENDED_STATE_KEYS:
+                view[key] = view.get(key, []) + value
+                update[key] = update.get(key, []) + value
+            else:
+                view[key] = update[key] = value
+    return update
+
+
+def _pdf_candidates(docs: List[Dict[str, Any]]) -> Iterator[Tuple[str, Any]]:
+    """Yield (name, id) for every API document that is a PDF."""
+    for doc in docs:
+        doc_id = doc.get('id')
+        if not doc_id:
+            continue
+        
+        doc_name = next((doc[key] for key in DOC_NAME_KEYS if doc.get(key)), 'Unknown')
+        doc_type = next((doc[key] for key in DOC_TYPE_KEYS if doc.get(key)), '')
+        if doc_type in PDF_DOC_TYPES or 'pdf' in doc_name.lower():
+            yield doc_name, doc_id
+
+
+def _pdf_link_entries(page_url: str, hrefs: List[str]) -> List[Dict[str, str]]:
+    """Build PDF url entries from raw hrefs, resolving relative links and dropping duplicates."""
+    pdf_urls = []
+    seen = set()
+    for href in hrefs:
+        if not href:
+            continue
+        pdf_url = urljoin(page_url, href)
+        if pdf_url in seen:
+            continue
+        seen.add(pdf_url)
+        doc_name = unquote(Path(urlparse(pdf_url).path).name) or 'Unknown'
+        pdf_urls.append({
+            'url': pdf_url,
+            'name': doc_name,
+            'id': pdf_url
+        })
+    return pdf_urls
+
+
+def _find_pdf_links_in_page(page_url: str, session: requests.Session) -> List[Dict[str, str]]:
+    """Scan the subsidy web page for PDF links with a plain HTTP request."""
+    response = session.get(page_url, timeout=30)
+    if response.status_code != 200:
+        logger.warning("Page fallback returned status code: %s", response.status_code)
+        return []
+    
+    # Imported on first use, since this fallback is rare; selectolax is optional
+    try:
+        from selectolax.parser import HTMLParser
+    except ImportError:  # Fall back to BeautifulSoup
+        from bs4 import BeautifulSoup
+        hrefs = [a.get('href') for a in BeautifulSoup(response.text, 'lxml').select(PDF_LINK_SELECTOR)]
+    else:
+        hrefs = [a.attributes.get('href') for a in HTMLParser(response.text).css(PDF_LINK_SELECTOR)]
+    return _pdf_link_entries(page_url, hrefs)
+
+
+@functools.lru_cache(maxsize=1)
+def _chromedriver_path() -> str:
+    """Resolve the ChromeDriver binary (at most once per process), trusting the local copy for 30 days."""
+    # Imported lazily so the HTTP path never pays for webdriver_manager
+    from webdriver_manager.chrome import ChromeDriverManager
+    from webdriver_manager.core.driver_cache import DriverCacheManager
+    
+    os.environ.setdefault("WDM_LOG_LEVEL", "0")
+    return ChromeDriverManager(cache_manager=DriverCacheManager(valid_range=30)).install()
 
-@traceable(name="extract_bdns_code")
-def extract_bdns_node(state: SubsidyState) -> SubsidyState:
+
+def _prefetch_chromedriver() -> None:
+    """Resolve the ChromeDriver path in the background so the first Selenium fallback doesn't wait on it."""
+    try:
+        _chromedriver_path()
+    except Exception as e:  # Retried (and reported) on first real use
+        logger.debug("ChromeDriver prefetch failed: %s", e)
+
+
+def _get_webdriver():
+    """Return the shared headless Chrome driver, creating it on first use (call with _webdriver_lock held)."""
+    global _webdriver
+    if _webdriver is None:
+        # Imported lazily so the HTTP path never pays for Selenium/ChromeDriver
+        from selenium import webdriver
+        from selenium.webdriver.chrome.options import Options
+        from selenium.webdriver.chrome.service import Service
+        
+        driver_path = _chromedriver_path()
+        
+        chrome_options = Options()
+        chrome_options.add_argument("--headless=new")
+        chrome_options.add_argument("--no-sandbox")
+        chrome_options.add_argument("--disable-dev-shm-usage")
+        
+        _webdriver = webdriver.Chrome(service=Service(driver_path), options=chrome_options)
+    return _webdriver
+
+
+@atexit.register
+def _shutdown_webdriver() -> None:
+    """Quit the shared headless Chrome driver, if one is running, at interpreter exit."""
+    global _webdriver
+    # Don't hold up shutdown behind a page load still in progress
+    if not _webdriver_lock.acquire(timeout=SELENIUM_WAIT_SECONDS):
+        return
+    try:
+        if _webdriver is not None:
+            try:
+                _webdriver.quit()
+            except Exception as e:
+                logger.debug("Error quitting ChromeDriver: %s", e)
+            _webdriver = None
+    finally:
+        _webdriver_lock.release()
+
+
+if USE_SELENIUM:
+    threading.Thread(target=_prefetch_chromedriver, name="chromedriver-prefetch", daemon=True).start()
+
+
+def _find_pdf_links_with_selenium(page_url: str) -> List[Dict[str, str]]:
+    """Scan a JS-rendered subsidy page for PDF links using headless Chrome."""
+    global _webdriver
+    from selenium.common.exceptions import TimeoutException
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support import expected_conditions as EC
+    from selenium.webdriver.support.ui import WebDriverWait
+    
+    # A single browser is reused across subsidies; it can only load one page at a time
+    with _webdriver_lock:
+        driver = _get_webdriver()
+        try:
+            driver.get(page_url)
+            try:
+                # Return as soon as the scripts have rendered a PDF link instead of sleeping
+                WebDriverWait(driver, SELENIUM_WAIT_SECONDS).until(
+                    EC.presence_of_element_located((By.CSS_SELECTOR, PDF_LINK_SELECTOR))
+                )
+            except TimeoutException:
+                logger.info("No PDF link rendered within %ss on %s", SELENIUM_WAIT_SECONDS, page_url)
+            hrefs = [a.get_attribute('href') for a in driver.find_elements(By.CSS_SELECTOR, PDF_LINK_SELECTOR)]
+        except Exception:
+            # Drop a possibly broken browser so the next call starts a fresh one
+            _webdriver = None
+            try:
+                driver.quit()
+            except Exception as quit_error:  # Must not hide the original error
+                logger.debug("Error quitting broken ChromeDriver: %s", quit_error)
+            raise
+    
+    return _pdf_link_entries(page_url, hrefs)
+
+
+def extract_bdns_node(state: SubsidyState) -> Dict[str, Any]:
     """Extract BDNS code from the URL or subsidy data."""
     try:
         bdns_code = state.get("bdns_code")
@@ -52,71 +277,88 @@ def extract_bdns_node(state: SubsidyState) -> SubsidyState:
             # Extract BDNS code from URL
             bdns_code = extract_bdns_from_url(source_url)
             if bdns_code:
-                logger.info(f"BDNS code extracted from URL: {bdns_code}")
-                state["bdns_code"] = bdns_code
+                logger.info("BDNS code extracted from URL: %s", bdns_code)
         
         if not bdns_code:
             # Try to get from subsidy_data
             subsidy_data = state.get("subsidy_data", {})
             bdns_code = subsidy_data.get("codigo_bdns") or subsidy_data.get("bdns_code")
-            if bdns_code:
-                state["bdns_code"] = bdns_code
         
         if not bdns_code:
-            state["error"] = "No BDNS code could be extracted"
-            return state
+            return {"error": "No BDNS code could be extracted"}
         
-        state["logs"] = state.get("logs", []) + [f"BDNS code: {bdns_code}"]
-        return state
+        return {"bdns_code": bdns_code, "logs": [f"BDNS code: {bdns_code}"]}
         
     except Exception as e:
-        logger.error(f"Error extracting BDNS: {e}")
-        state["error"] = f"Error extracting BDNS: {e}"
-        return state
+        logger.error("Error extracting BDNS: %s", e)
+        return {"error": f"Error extracting BDNS: {e}"}
 
 
-@traceable(name="fetch_subsidy_information")
-def fetch_subsidy_info_node(state: SubsidyState) -> SubsidyState:
+def fetch_subsidy_info_node(state: SubsidyState) -> Dict[str, Any]:
     """Fetch subsidy information from the government API."""
     try:
         bdns_code = state.get("bdns_code")
         if not bdns_code:
-            state["error"] = "No BDNS code available for API call"
-            return state
+            return {"error": "No BDNS code available for API call"}
         
         # Construct API URL
         api_url = f"https://www.subvenciones.gob.es/bdnstrans/api/convocatorias?numConv={bdns_code}&vpd=GE"
-        logger.info(f"Calling API: {api_url}")
+        logger.info("Calling API: %s", api_url)
+        
+        existing_data = state.get("subsidy_data", {})
+        
+        # Reuse a recent response, and revalidate older ones with the server's validators
+        cached = load_cached_api_response(bdns_code)
+        if cached and time.time() - cached.get('fetched_at', 0) < API_CACHE_TTL:
+            logger.info("Using cached API response for BDNS %s", bdns_code)
+            subsidy_data = {**existing_data, **cached['data']}
+            return {
+                "subsidy_data": subsidy_data,
+                "subsidy_data_json": dumps_json(subsidy_data),
+                "logs": ["API data loaded from cache"]
+            }
+        
+        request_headers = {}
+        if cached:
+            if cached.get('etag'):
+                request_headers['If-None-Match'] = cached['etag']
+            if cached.get('last_modified'):
+                request_headers['If-Modified-Since'] = cached['last_modified']
         
         # Make API request
-        session = requests.Session()
-        session.headers.update(get_api_headers())
-        
-        response = session.get(api_url, timeout=30)
-        if response.status_code == 200:
-            data = response.json()
-            logger.info(f"API response received: {len(response.text)} characters")
-            
-            # Merge with existing subsidy data
-            existing_data = state.get("subsidy_data", {})
-            existing_data.update(data)
-            state["subsidy_data"] = existing_data
-            
-            state["logs"] = state.get("logs", []) + ["API data fetched successfully"]
+        response = _HTTP.get(api_url, timeout=30, headers=request_headers)
+        if cached and response.status_code == 304:
+            logger.info("Cached API response not modified for BDNS %s", bdns_code)
+            data = cached['data']
+            store_cached_api_response(bdns_code, data, cached.get('etag'), cached.get('last_modified'))
+        elif response.status_code == 200:
+            # Parse the raw body with orjson instead of decoding it to text for the stdlib parser
+            data = loads_json(response.content)
+            logger.info("API response received: %d bytes", len(response.content))
+            store_cached_api_response(bdns_code, data, response.headers.get('ETag'),
+                                      response.headers.get('Last-Modified'))
         else:
-            logger.warning(f"API returned status code: {response.status_code}")
-            state["logs"] = state.get("logs", []) + [f"API call failed with status: {response.status_code}"]
-        
-        return state
+            data = None
+        
+        if data is None:
+            logger.warning("API returned status code: %s", response.status_code)
+            return {"logs": [f"API call failed with status: {response.status_code}"]}
+        
+        # Merge with existing subsidy data
+        subsidy_data = {**existing_data, **data}
+        return {
+            "subsidy_data": subsidy_data,
+            # Serialized once here so the analysis prompt does not re-dump it
+            "subsidy_data_json": dumps_json(subsidy_data),
+            "logs": ["API data fetched successfully"]
+        }
         
     except Exception as e:
-        logger.error(f"Error fetching subsidy info: {e}")
-        state["error"] = f"Error fetching subsidy info: {e}"
-        return state
+        logger.error("Error fetching subsidy info: %s", e)
+        return {"error": f"Error fetching subsidy info: {e}"}
 
 
-@traceable(name="find_pdf_urls")
-def find_pdf_urls_node(state: SubsidyState) -> SubsidyState:
+def find_pdf_urls_node(state: SubsidyState) -> Dict[str, Any]:
     """Find all PDF URLs from the subsidy data."""
     try:
         subsidy_data = state.get("subsidy_data", {})
@@ -125,122 +367,217 @@ def find_pdf_urls_node(state: SubsidyState) -> SubsidyState:
         
         # Check for documents in API response
         if 'documentos' in subsidy_data and subsidy_data['documentos']:
-            logger.info(f"Found {len(subsidy_data['documentos'])} documents in API")
+            logger.info("Found %d documents in API", len(subsidy_data['documentos']))
             
-            for doc in subsidy_data['documentos']:
-                doc_name = doc.get('nombreFic') or doc.get('nombre') or doc.get('name') or 'Unknown'
-                doc_type = doc.get('tipo') or doc.get('type') or ''
-                doc_id = doc.get('id')
-                
-                if (doc_type == 'PDF' or 'pdf' in doc_name.lower()) and doc_id:
-                    doc_url = f"https://www.subvenciones.gob.es/bdnstrans/GE/es/convocatoria/{bdns_code}/document/{doc_id}"
-                    pdf_urls.append({
-                        'url': doc_url,
-                        'name': doc_name,
-                        'id': doc_id
-                    })
-                    logger.info(f"Found PDF: {doc_name}")
+            for doc_name, doc_id in _pdf_candidates(subsidy_data['documentos']):
+                doc_url = f"https://www.subvenciones.gob.es/bdnstrans/GE/es/convocatoria/{bdns_code}/document/{doc_id}"
+                pdf_urls.append({
+                    'url': doc_url,
+                    'name': doc_name,
+                    'id': doc_id
+                })
+                logger.info("Found PDF: %s", doc_name)
         else:
             logger.info("No documents found in API response")
+            source_url = state.get("source_url")
+            
+            if source_url:
+                # Fall back to scanning the subsidy page itself; best effort, the
+                # analysis still runs on the API data alone if the page cannot be read
+                try:
+                    pdf_urls = _find_pdf_links_in_page(source_url, _HTTP)
+                    
+                    if not pdf_urls and USE_SELENIUM:
+                        logger.info("No PDF links in static page, retrying with Selenium")
+                        pdf_urls = _find_pdf_links_with_selenium(source_url)
+                except Exception as e:
+                    logger.warning("Could not scan %s for PDF links: %s", source_url, e)
+                    pdf_urls = []
+                
+                logger.info("Found %d PDF links in page %s", len(pdf_urls), source_url)
+        
+        return {"pdf_urls": pdf_urls, "logs": [f"Found {len(pdf_urls)} PDFs"]}
         
-        state["pdf_urls"] = pdf_urls
-        state["logs"] = state.get("logs", []) + [f"Found {len(pdf_urls)} PDFs"]
-        return state
+    except Exception as e:
+        logger.error("Error finding PDFs: %s", e)
+        return {"error": f"Error finding PDFs: {e}"}
+
+
+def _download_pdf(session: requests.Session, pdf_info: Dict[str, str],
+                  bdns_code: str, download_dir: Path) -> Optional[Dict[str, Any]]:
+    """
+    Download a single PDF to disk (network stage).
+    
+    Returns:
+        The finished {filename, text, path} entry on a cache hit, a dict with the
+        saved path and HTTP validators still to be extracted, or None on failure
+    """
+    pdf_url = pdf_info['url']
+    doc_name = pdf_info['name']
+    doc_id = pdf_info.get('id')
+    partial_path = None
+    
+    try:
+        # Reuse a previous download, revalidating it when the server gave us validators
+        cached = load_cached_pdf(bdns_code, doc_id) if doc_id else None
+        request_headers = {}
+        if cached:
+            if not (cached.get('etag') or cached.get('last_modified')):
+                logger.info("Using cached PDF: %s", doc_name)
+                return {'filename': doc_name, 'text': cached['text'], 'path': cached['path']}
+            if cached.get('etag'):
+                request_headers['If-None-Match'] = cached['etag']
+            if cached.get('last_modified'):
+                request_headers['If-Modified-Since'] = cached['last_modified']
+        
+        logger.info("Downloading: %s from %s", doc_name, pdf_url)
+        
+        # The document id (or URL) keeps same-named documents from sharing a file
+        doc_key = hashlib.sha256(str(doc_id or pdf_url).encode()).hexdigest()[:12]
+        pdf_filename = f"{bdns_code}_{doc_key}_{clean_filename(doc_name)}.pdf"
+        pdf_path = download_dir / pdf_filename
+        
+        with session.get(pdf_url, stream=True, timeout=60, headers=request_headers) as response:
+            if cached and response.status_code == 304:
+                logger.info("Cached PDF not modified: %s", doc_name)
+                return {'filename': doc_name, 'text': cached['text'], 'path': cached['path']}
+            
+            if response.status_code != 200:
+                logger.warning("Failed to download %s: HTTP %s", doc_name, response.status_code)
+                return None
+            
+            chunks = filter(None, response.iter_content(chunk_size=PDF_CHUNK_SIZE))
+            first_chunk = next(chunks, b'')
+            
+            # Validate it's a PDF before writing anything, so error pages are not downloaded in full
+            if not validate_pdf_content(first_chunk):
+                logger.warning("Downloaded content is not a valid PDF: %s", doc_name)
+                return None
+            
+            # Stream straight to disk instead of buffering the whole body in memory
+            # Only references to the last two chunks are kept for the trailer check
+            # A unique partial file per download, so concurrent downloads never share one
+            previous, last = b'', first_chunk
+            partial_fd, partial_name = tempfile.mkstemp(dir=download_dir, prefix=pdf_filename + ".", suffix=".part")
+            partial_path = Path(partial_name)
+            with os.fdopen(partial_fd, 'wb') as f:
+                f.write(first_chunk)
+                for chunk in chunks:
+                    f.write(chunk)
+                    previous, last = last, chunk
+            tail = previous[-PDF_TRAILER_WINDOW:] + last
+            
+            etag = response.headers.get('ETag')
+            last_modified = response.headers.get('Last-Modified')
+        
+        # A missing trailer means the transfer was cut short
+        if not has_pdf_trailer(tail):
+            partial_path.unlink(missing_ok=True)
+            logger.warning("Downloaded PDF is truncated: %s", doc_name)
+            return None
+        
+        partial_path.replace(pdf_path)
+        logger.info("Saved PDF to: %s", pdf_path)
+        
+        return {
+            'filename': doc_name,
+            'path': str(pdf_path),
+            'id': doc_id,
+            'etag': etag,
+            'last_modified': last_modified
+        }
         
     except Exception as e:
-        logger.error(f"Error finding PDFs: {e}")
-        state["error"] = f"Error finding PDFs: {e}"
-        return state
+        if partial_path is not None:
+            partial_path.unlink(missing_ok=True)
+        logger.error("Error downloading %s: %s", doc_name, e)
+        return None
+
+
+def _extract_downloaded_pdf(bdns_code: str, download: Dict[str, Any]) -> Optional[Dict[str, str]]:
+    """Extract the text of a downloaded PDF and cache it (CPU stage)."""
+    doc_name = download['filename']
+    
+    try:
+        text = extract_pdf_text(download['path'])
+        
+        if not text.strip():  # Only keep it if we extracted text
+            logger.warning("No text extracted from %s", doc_name)
+            return None
+        
+        logger.info("Extracted %d characters from %s", len(text), doc_name)
+        if download['id']:
+            store_cached_pdf(bdns_code, download['id'], text, download['path'],
+                             download['etag'], download['last_modified'])
+        
+        return {
+            'filename': doc_name,
+            'text': text,
+            'path': download['path']
+        }
+        
+    except Exception as e:
+        logger.error("Error extracting text from %s: %s", doc_name, e)
+        return None
+
+
+@traceable(name="prepare_subsidy")
+def prepare_node(state: SubsidyState) -> Dict[str, Any]:
+    """Resolve the BDNS code, fetch the subsidy data and find its PDFs in a single graph step."""
+    return _run_steps(state, extract_bdns_node, fetch_subsidy_info_node, find_pdf_urls_node)
 
 
 @traceable(name="download_and_extract_pdfs")
-def download_pdfs_node(state: SubsidyState) -> SubsidyState:
-    """Download all PDFs and extract text content."""
+def download_pdfs_node(state: SubsidyState) -> Dict[str, Any]:
+    """Download all PDFs concurrently and extract text content."""
     try:
         pdf_urls = state.get("pdf_urls", [])
         bdns_code = state.get("bdns_code")
-        pdf_texts = []
-        successful_downloads = 0
         
         if not pdf_urls:
             logger.info("No PDFs to download")
-            state["pdf_texts"] = []
-            state["pdf_count"] = 0
-            state["logs"] = state.get("logs", []) + ["No PDFs to download"]
-            return state
+            return {"pdf_count": 0, "logs": ["No PDFs to download"]}
         
         # Create download directory
         download_dir = create_download_directory()
         
-        # Setup session
-        session = requests.Session()
-        session.headers.update(get_api_headers())
-        
-        for pdf_info in pdf_urls:
-            pdf_url = pdf_info['url']
-            doc_name = pdf_info['name']
-            
-            try:
-                logger.info(f"Downloading: {doc_name} from {pdf_url}")
-                
-                response = session.get(pdf_url, stream=True, timeout=60)
-                if response.status_code == 200:
-                    content_type = response.headers.get('content-type', '')
-                    
-                    # Validate it's a PDF
-                    if validate_pdf_content(response.content):
-                        # Save PDF
-                        safe_name = clean_filename(doc_name)
-                        pdf_filename = f"{bdns_code}_{safe_name}.pdf"
-                        pdf_path = download_dir / pdf_filename
-                        
-                        with open(pdf_path, 'wb') as f:
-                            f.write(response.content)
-                        
-                        logger.info(f"Saved PDF to: {pdf_path}")
-                        
-                        # Extract text
-                        try:
-                            pdf_reader = PyPDF2.PdfReader(io.BytesIO(response.content))
-                            text = ""
-                            
-                            for page in pdf_reader.pages:
-                                text += page.extract_text() + "\n"
-                            
-                            if text.strip():  # Only add if we extracted text
-                                pdf_texts.append({
-                                    'filename': doc_name,
-                                    'text': text,
-                                    'path': str(pdf_path)
-                                })
-                                successful_downloads += 1
-                                logger.info(f"Extracted {len(text)} characters from {doc_name}")
-                            else:
-                                logger.warning(f"No text extracted from {doc_name}")
-                                
-                        except Exception as e:
-                            logger.error(f"Error extracting text from {doc_name}: {e}")
-                    else:
-                        logger.warning(f"Downloaded content is not a valid PDF: {doc_name}")
+        # Downloads run side by side; each finished download is handed to a separate
+        # extraction executor so CPU work never holds up the remaining network requests
+        results: Dict[int, Optional[Dict[str, str]]] = {}
+        max_workers = min(MAX_PDF_DOWNLOAD_WORKERS, len(pdf_urls))
+        with ThreadPoolExecutor(max_workers=max_workers) as download_pool, \
+                ThreadPoolExecutor(max_workers=MAX_PDF_EXTRACTION_WORKERS) as extraction_pool:
+            downloads = {
+                download_pool.submit(_download_pdf, _HTTP, pdf_info, bdns_code, download_dir): index
+                for index, pdf_info in enumerate(pdf_urls)
+            }
+            extractions = {}
+            for future in as_completed(downloads):
+                download = future.result()
+                if download and 'text' not in download:
+                    extractions[downloads[future]] = extraction_pool.submit(_extract_downloaded_pdf, bdns_code, download)
                 else:
-                    logger.warning(f"Failed to download {doc_name}: HTTP {response.status_code}")
-                    
-            except Exception as e:
-                logger.error(f"Error downloading {doc_name}: {e}")
+                    results[downloads[future]] = download
+            
+            for index, future in extractions.items():
+                results[index] = future.result()
         
-        state["pdf_texts"] = pdf_texts
-        state["pdf_count"] = successful_downloads
-        state["logs"] = state.get("logs", []) + [f"Downloaded and processed {successful_downloads} PDFs"]
-        return state
+        # Keep the original document order
+        pdf_texts = [results[index] for index in sorted(results) if results[index]]
+        
+        successful_downloads = len(pdf_texts)
+        return {
+            "pdf_texts": pdf_texts,
+            "pdf_count": successful_downloads,
+            "logs": [f"Downloaded and processed {successful_downloads} PDFs"]
+        }
         
     except Exception as e:
-        logger.error(f"Error in download process: {e}")
-        state["error"] = f"Error in download process: {e}"
-        return state
+        logger.error("Error in download process: %s", e)
+        return {"error": f"Error in download process: {e}"}
 
 
-@traceable(name="analyze_subsidy_with_llm")
-def analyze_subsidy_node(state: SubsidyState, llm: LanguageModel) -> SubsidyState:
+def analyze_subsidy_node(state: SubsidyState, llm: LanguageModel) -> Dict[str, Any]:
     """Analyze the subsidy using the LLM."""
     try:
         subsidy_data = state.get("subsidy_data", {})
@@ -248,56 +585,68 @@ def analyze_subsidy_node(state: SubsidyState, llm: LanguageModel) -> SubsidyStat
         
         # Combine all PDF texts
         combined_pdf_text = ""
+        original_tokens = sent_tokens = 0
         if pdf_texts:
+            # Drop boilerplate and split the prompt token budget across the documents
+            texts, original_tokens, sent_tokens = fit_pdf_texts_to_budget(
+                [pdf['text'] for pdf in pdf_texts], llm.model_name
+            )
+            logger.info("PDF text tokens: %d extracted, %d sent", original_tokens, sent_tokens)
             pdf_sections = []
-            for pdf in pdf_texts:
-                pdf_sections.append(f"=== DOCUMENT: {pdf['filename']} ===\n{pdf['text']}")
+            for pdf, text in zip(pdf_texts, texts):
+                pdf_sections.append(f"=== DOCUMENT: {pdf['filename']} ===\n{text}")
             combined_pdf_text = "\n\n".join(pdf_sections)
         
+        subsidy_data_json = state.get("subsidy_data_json") or dumps_json(subsidy_data)
+        
         # Choose prompt based on whether we have PDF content
         if combined_pdf_text:
-            prompt = ANALYSIS_PROMPT_WITH_PDF.format(
-                subsidy_data=json.dumps(subsidy_data, indent=2, ensure_ascii=False),
+            prompt = _PROMPT_WITH_PDF.substitute(
+                subsidy_data=subsidy_data_json,
                 pdf_text=combined_pdf_text
             )
         else:
-            prompt = ANALYSIS_PROMPT_WITHOUT_PDF.format(
-                subsidy_data=json.dumps(subsidy_data, indent=2, ensure_ascii=False)
+            prompt = _PROMPT_WITHOUT_PDF.substitute(
+                subsidy_data=subsidy_data_json
             )
         
         # Call LLM
         messages = [
-            SystemMessage(content=SYSTEM_PROMPT),
+            _SYSTEM_MESSAGE,
             HumanMessage(content=prompt)
         ]
         
+        # Identical requests (same model and prompt) are answered from the LLM's response cache
         logger.info("Calling LLM for analysis...")
-        response, token_usage = llm.invoke(messages)
+        response, token_usage = llm.invoke_json(messages)
         analysis_text = response.content
+        from_cache = response.response_metadata.get('from_cache', False)
+        if from_cache:
+            logger.info("Using cached LLM analysis")
         
         # Log token usage
         if token_usage:
             usage = token_usage[0]
-            logger.info(f"Token usage - Model: {usage['model_name']}, Input: {usage['input_tokens']}, Output: {usage['output_tokens']}")
+            logger.info("Token usage - Model: %s, Input: %s, Output: %s", usage['model_name'], usage['input_tokens'], usage['output_tokens'])
         
         # Extract JSON from response
         analysis_json = extract_json_from_text(analysis_text)
         
+        update: Dict[str, Any] = {}
         if analysis_json:
             # Try to parse into structured format
             try:
-                analysis_result = SubsidyAnalysisResult(**analysis_json)
-                state["analysis_result"] = analysis_result
+                update["analysis_result"] = SubsidyAnalysisResult.model_validate(analysis_json)
                 logger.info("Successfully parsed analysis into structured format")
             except Exception as e:
-                logger.warning(f"Could not parse into structured format: {e}")
+                logger.warning("Could not parse into structured format: %s", e)
                 # Store raw JSON
-                state["raw_analysis"] = analysis_json
+                update["raw_analysis"] = analysis_json
         else:
             logger.error("Could not extract JSON from LLM response")
-            state["error"] = "Could not extract valid JSON from LLM response"
+            update["error"] = "Could not extract valid JSON from LLM response"
             # Store raw response for debugging
-            state["raw_analysis"] = {"raw_response": analysis_text}
+            update["raw_analysis"] = {"raw_response": analysis_text}
         
         # Add metadata
         metadata = {
@@ -307,25 +656,110 @@ def analyze_subsidy_node(state: SubsidyState, llm: LanguageModel) -> SubsidyStat
             'pdf_count': len(pdf_texts),
             'model_used': llm.model_name,
             'version': '3.0-langgraph',
-            'token_usage': token_usage[0] if token_usage else None
+            'token_usage': token_usage[0] if token_usage else None,
+            'pdf_tokens': {'extracted': original_tokens, 'sent': sent_tokens},
+            'from_cache': from_cache
         }
         
-        if state.get("analysis_result"):
-            state["analysis_result"].metadata = metadata
-        elif state.get("raw_analysis"):
-            state["raw_analysis"]["metadata"] = metadata
+        if update.get("analysis_result"):
+            update["analysis_result"].metadata = metadata
+        else:
+            update["raw_analysis"]["metadata"] = metadata
+        
+        update["logs"] = ["LLM analysis completed"]
+        return update
         
-        state["logs"] = state.get("logs", []) + ["LLM analysis completed"]
-        return state
+    except Exception as e:
+        logger.error("Error in LLM analysis: %s", e)
+        return {"error": f"Error in LLM analysis: {e}"}
+
+
+def _analyze_single_subsidy(subsidy_data: Dict[str, Any], llm: LanguageModel) -> Dict[str, Any]:
+    """Analyze one subsidy from its data with its own LLM call (fallback of a failed batch)."""
+    update = analyze_subsidy_node({
+        "subsidy_data": subsidy_data,
+        "bdns_code": subsidy_data.get("codigo_bdns") or subsidy_data.get("bdns_code")
+    }, llm)
+    return {
+        "analysis_result": update.get("analysis_result"),
+        "raw_analysis": update.get("raw_analysis"),
+        "error": update.get("error")
+    }
+
+
+@traceable(name="analyze_subsidy_batch_with_llm")
+def analyze_subsidy_batch(subsidies: List[Dict[str, Any]], llm: LanguageModel) -> List[Dict[str, Any]]:
+    """
+    Analyze several subsidies (from their data only) with a single LLM call.
+    
+    Returns:
+        One {analysis_result, raw_analysis, error} dict per subsidy, in input order
+    """
+    prompt = _BATCH_PROMPT.substitute(
+        subsidy_batch=dumps_json({"batch": subsidies}),
+        count=len(subsidies)
+    )
+    messages = [
+        _SYSTEM_MESSAGE,
+        HumanMessage(content=prompt)
+    ]
+    
+    logger.info("Calling LLM for a batch of %d subsidies...", len(subsidies))
+    response, token_usage = llm.invoke_json(
+        messages, max_tokens=min(MAX_OUTPUT_TOKENS * len(subsidies), BATCH_MAX_OUTPUT_TOKENS)
+    )
+    
+    batch_json = extract_json_from_text(response.content)
+    analyses = batch_json.get("analisis") if batch_json else None
+    if not isinstance(analyses, list) or len(analyses) != len(subsidies):
+        # E.g. a response cut off at the output limit: analyze each subsidy on its own instead
+        logger.warning("LLM batch response does not contain one analysis per subsidy; analyzing them one by one")
+        return [_analyze_single_subsidy(subsidy_data, llm) for subsidy_data in subsidies]
+    
+    results = []
+    for subsidy_data, analysis_json in zip(subsidies, analyses):
+        metadata = {
+            'analysis_date': datetime.now().isoformat(),
+            'subsidy_code': subsidy_data.get("codigo_bdns") or subsidy_data.get("bdns_code"),
+            'used_pdf': False,
+            'pdf_count': 0,
+            'model_used': llm.model_name,
+            'version': '3.0-langgraph',
+            'batch_size': len(subsidies),
+            # Usage of the whole batch call, shared by every entry (not per subsidy)
+            'batch_token_usage': token_usage[0] if token_usage else None
+        }
         
+        if not isinstance(analysis_json, dict):
+            results.append({
+                "analysis_result": None,
+                "raw_analysis": {"raw_response": analysis_json, "metadata": metadata},
+                "error": "Invalid analysis entry in LLM batch response"
+            })
+            continue
+        
+        try:
+            analysis_result = SubsidyAnalysisResult.model_validate(analysis_json)
+            analysis_result.metadata = metadata
+            results.append({"analysis_result": analysis_result, "raw_analysis": None, "error": None})
+        except Exception as e:
+            logger.warning("Could not parse batch entry into structured format: %s", e)
+            analysis_json["metadata"] = metadata
+            results.append({"analysis_result": None, "raw_analysis": analysis_json, "error": None})
+    
+    return results
+
+
+def _write_results(filepath: Path, save_data: Dict[str, Any]) -> None:
+    """Write an analysis file (runs on the background I/O pool)."""
+    try:
+        write_json_file(filepath, save_data)
+        logger.info("Analysis saved to: %s", filepath)
     except Exception as e:
-        logger.error(f"Error in LLM analysis: {e}")
-        state["error"] = f"Error in LLM analysis: {e}"
-        return state
+        logger.error("Error saving results to %s: %s", filepath, e)
 
 
-@traceable(name="save_analysis_results")
-def save_results_node(state: SubsidyState) -> SubsidyState:
+def save_results_node(state: SubsidyState) -> Dict[str, Any]:
     """Save the analysis results to file."""
     try:
         analysis_result = state.get("analysis_result")
@@ -335,7 +769,7 @@ def save_results_node(state: SubsidyState) -> SubsidyState:
         
         if not (analysis_result or raw_analysis) or not bdns_code:
             logger.warning("No analysis result or BDNS code to save")
-            return state
+            return {}
         
         # Create download directory
         download_dir = create_download_directory()
@@ -351,18 +785,20 @@ def save_results_node(state: SubsidyState) -> SubsidyState:
             # Convert Pydantic model to dict
             save_data = analysis_result.model_dump()
         else:
-            save_data = raw_analysis
+            # A copy: the caller gets raw_analysis back while the write is still running
+            save_data = copy.deepcopy(raw_analysis)
         
-        # Save analysis
-        with open(filepath, 'w', encoding='utf-8') as f:
-            json.dump(save_data, f, indent=2, ensure_ascii=False)
+        # Save analysis in the background
+        _IO_POOL.submit(_write_results, filepath, save_data)
         
-        logger.info(f"Analysis saved to: {filepath}")
-        state["logs"] = state.get("logs", []) + [f"Results saved to {filepath}"]
-        
-        return state
+        return {"logs": [f"Saving results to {filepath}"]}
         
     except Exception as e:
-        logger.error(f"Error saving results: {e}")
-        state["error"] = f"Error saving results: {e}"
-        return state
\ No newline at end of file
+        logger.error("Error saving results: %s", e)
+        return {"error": f"Error saving results: {e}"}
+
+
+@traceable(name="analyze_and_save_subsidy")
+def analyze_and_save_node(state: SubsidyState, llm: LanguageModel) -> Dict[str, Any]:
+    """Analyze the subsidy with the LLM and save the results in a single graph step."""
+    return _run_steps(state, functools.partial(analyze_subsidy_node, llm=llm), save_results_node)
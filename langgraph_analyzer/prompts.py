@@ -4,6 +4,8 @@ Prompts for the Subsidy Analyzer
 ================================
 
 This module contains all the prompts used for LLM interactions.
+Placeholders use string.Template syntax ($name), so JSON braces need no escaping.
+Dynamic sections go last so the static instructions form a stable, cacheable prefix.
 """
 
 SYSTEM_PROMPT = """Eres un analista experto en convocatorias de subvenciones españolas. Tu tarea es extraer información estructurada y relevante de los documentos oficiales de convocatorias.
@@ -13,44 +15,38 @@ Debes extraer EXACTAMENTE la información solicitada en el formato JSON especifi
 
 ANALYSIS_PROMPT_WITH_PDF = """# ANÁLISIS DE CONVOCATORIA DE SUBVENCIÓN
 
-## DATOS DE LA CONVOCATORIA:
-{subsidy_data}
-
-## DOCUMENTOS OFICIALES:
-{pdf_text}
-
 ## INSTRUCCIONES:
 
-Extrae la siguiente información de la convocatoria y devuélvela en formato JSON:
+Extrae la siguiente información de la convocatoria (datos y documentos oficiales al final) y devuélvela en formato JSON:
 
 ```json
-{{
-    "identificacion": {{
+{
+    "identificacion": {
         "organismo_emisor": "Organismo que publica la ayuda (ej: Consejería, Dirección General, etc.)",
         "titulo_convocatoria": "Título completo o objeto de la convocatoria",
         "base_reguladora": "Normativa principal (Orden, Real Decreto, etc. con fecha)"
-    }},
+    },
     
-    "detalles": {{
+    "detalles": {
         "beneficiarios": ["Lista de tipos de beneficiarios que pueden solicitar"],
         "finalidad_ayuda": "Descripción del concepto específico que se subvenciona"
-    }},
+    },
     
-    "condiciones_economicas": {{
+    "condiciones_economicas": {
         "presupuesto_total": "Cantidad total disponible (incluir moneda y detalles)",
-        "distribucion_territorial": {{
+        "distribucion_territorial": {
             "provincia/territorio": "cantidad asignada"
-        }},
+        },
         "cuantia_por_solicitud": "Importe máximo por beneficiario o método de cálculo"
-    }},
+    },
     
-    "plazos_procedimiento": {{
+    "plazos_procedimiento": {
         "plazo_presentacion": "Fechas de inicio y fin (formato: 'Del DD/MM/AAAA al DD/MM/AAAA' o descripción)",
         "plazo_resolucion": "Tiempo máximo para resolver (ej: 'Tres meses', 'Seis meses')",
         "medio_presentacion": "Cómo presentar (ej: 'Electrónica exclusivamente', plataforma específica)",
         "enlace_tramite": "URL completa si está disponible"
-    }}
-}}
+    }
+}
 ```
 
 ## REGLAS DE EXTRACCIÓN:
@@ -62,57 +58,105 @@ Extrae la siguiente información de la convocatoria y devuélvela en formato JSO
 5. **CUANTÍAS**: Incluye todos los detalles sobre importes, porcentajes, módulos o sistemas de cálculo
 6. **FECHAS**: Mantén el formato original de las fechas tal como aparecen en el documento
 
+## DATOS DE LA CONVOCATORIA:
+$subsidy_data
+
+## DOCUMENTOS OFICIALES:
+$pdf_text
+
 IMPORTANTE: Devuelve ÚNICAMENTE el JSON, sin explicaciones adicionales."""
 
 
 ANALYSIS_PROMPT_WITHOUT_PDF = """# ANÁLISIS DE CONVOCATORIA DE SUBVENCIÓN
 
-## DATOS DE LA CONVOCATORIA:
-{subsidy_data}
-
 ## INSTRUCCIONES:
 
-Basándote en los datos disponibles y tu conocimiento sobre convocatorias de subvenciones españolas, genera una estructura JSON con la información típica de este tipo de convocatoria.
+Basándote en los datos disponibles (al final) y tu conocimiento sobre convocatorias de subvenciones españolas, genera una estructura JSON con la información típica de este tipo de convocatoria.
 
 Devuelve la información en el siguiente formato JSON:
 
 ```json
-{{
-    "identificacion": {{
+{
+    "identificacion": {
         "organismo_emisor": "Organismo que probablemente publica esta ayuda",
         "titulo_convocatoria": "Título o descripción de la convocatoria",
         "base_reguladora": "Normativa que probablemente la regula"
-    }},
+    },
     
-    "detalles": {{
+    "detalles": {
         "beneficiarios": ["Tipos típicos de beneficiarios para este tipo de ayuda"],
         "finalidad_ayuda": "Propósito general de la subvención"
-    }},
+    },
     
-    "condiciones_economicas": {{
+    "condiciones_economicas": {
         "presupuesto_total": "Información no disponible - Requiere documento oficial",
-        "distribucion_territorial": {{}},
+        "distribucion_territorial": {},
         "cuantia_por_solicitud": "Información no disponible - Requiere documento oficial"
-    }},
+    },
     
-    "plazos_procedimiento": {{
+    "plazos_procedimiento": {
         "plazo_presentacion": "Información no disponible - Consultar convocatoria oficial",
         "plazo_resolucion": "Típicamente entre 3-6 meses",
         "medio_presentacion": "Generalmente electrónica",
         "enlace_tramite": null
-    }}
-}}
+    }
+}
+```
+
+NOTA: Esta es una aproximación basada en datos limitados. Para información precisa, es necesario acceder a los documentos oficiales de la convocatoria.
+
+## DATOS DE LA CONVOCATORIA:
+$subsidy_data"""
+
+
+BATCH_ANALYSIS_PROMPT = """# ANÁLISIS DE VARIAS CONVOCATORIAS DE SUBVENCIÓN
+
+## INSTRUCCIONES:
+
+Analiza CADA convocatoria de la lista "batch" (al final) por separado, basándote en sus datos disponibles. No mezcles información entre convocatorias.
+
+Devuelve un único objeto JSON con la clave "analisis", que contenga un elemento por convocatoria en el mismo orden que la lista "batch":
+
+```json
+{
+    "analisis": [
+        {
+            "identificacion": {
+                "organismo_emisor": "Organismo que publica la ayuda",
+                "titulo_convocatoria": "Título o descripción de la convocatoria",
+                "base_reguladora": "Normativa que la regula"
+            },
+            "detalles": {
+                "beneficiarios": ["Tipos de beneficiarios que pueden solicitar"],
+                "finalidad_ayuda": "Propósito de la subvención"
+            },
+            "condiciones_economicas": {
+                "presupuesto_total": "Cantidad total disponible o 'No especificado'",
+                "distribucion_territorial": {},
+                "cuantia_por_solicitud": "Importe por beneficiario o 'No especificado'"
+            },
+            "plazos_procedimiento": {
+                "plazo_presentacion": "Fechas de presentación o 'No especificado'",
+                "plazo_resolucion": "Tiempo máximo para resolver o 'No especificado'",
+                "medio_presentacion": "Cómo presentar la solicitud",
+                "enlace_tramite": null
+            }
+        }
+    ]
+}
 ```
 
-NOTA: Esta es una aproximación basada en datos limitados. Para información precisa, es necesario acceder a los documentos oficiales de la convocatoria."""
+## DATOS DE LAS CONVOCATORIAS ($count en total):
+$subsidy_batch
 
+IMPORTANTE: Devuelve ÚNICAMENTE el JSON, con exactamente $count elementos en "analisis", sin explicaciones adicionales."""
 
 EXTRACTION_VALIDATION_PROMPT = """Valida que la siguiente extracción de datos sea correcta y completa:
 
 EXTRACCIÓN:
-{extraction}
+$extraction
 
 TEXTO ORIGINAL (fragmento):
-{original_text}
+$original_text
 
 Si encuentras errores o información faltante que sí está en el texto original, devuelve un JSON con las correcciones necesarias. Si todo está correcto, devuelve {"valid": true}."""
\ No newline at end of file
@@ -6,7 +6,8 @@ Schemas for the Subsidy Analyzer
 This module defines the data schemas and types used throughout the analyzer.
 """
 
-from typing import Dict, List, Optional, TypedDict, Any
+import operator
+from typing import Annotated, Dict, List, Optional, TypedDict, Any
 from datetime import datetime
 from pydantic import BaseModel, Field, ConfigDict
 
@@ -63,8 +64,9 @@ class SubsidyState(TypedDict):
     
     # Processing data
     subsidy_data: Dict[str, Any]
+    subsidy_data_json: Optional[str]  # subsidy_data serialized for the prompt
     pdf_urls: List[Dict[str, str]]  # List of {url, name, id}
-    pdf_texts: List[Dict[str, str]]  # List of {filename, text, path}
+    pdf_texts: Annotated[List[Dict[str, str]], operator.add]  # List of {filename, text, path}
     pdf_count: int
     
     # Results
@@ -73,5 +75,5 @@ class SubsidyState(TypedDict):
     
     # Tracking
     error: Optional[str]
-    logs: List[str]
+    logs: Annotated[List[str], operator.add]
     processing_time: Optional[float]
\ No newline at end of file
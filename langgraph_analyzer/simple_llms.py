@@ -8,13 +8,21 @@ dependency issues when testing with langgraph dev.
 """
 
 import os
+from typing import Optional
 from langchain_openai import ChatOpenAI
+from langchain_core.messages import AIMessage
 from langchain_core.runnables.config import RunnableConfig
 from langsmith import traceable
 from dotenv import load_dotenv
 
+from langgraph_analyzer.cache import llm_cache_key, load_cached_response, store_cached_response
+from langgraph_analyzer.utils import extract_json_from_text, count_tokens
+
 load_dotenv()
 
+# Output token limit of one analysis (max_tokens of the model)
+MAX_OUTPUT_TOKENS = 4000
+
 
 class SimpleLLM:
     """Simplified LLM class that only supports OpenAI models."""
@@ -31,32 +39,92 @@ class SimpleLLM:
             model_name=model_name,
             openai_api_key=os.getenv("OPENAI_API_KEY"),
             temperature=0.2,
-            max_tokens=4000
+            max_tokens=MAX_OUTPUT_TOKENS,
+            stream_usage=True  # Streams end with a chunk carrying usage_metadata
         )
+        # JSON mode: the API guarantees a single well-formed JSON object
+        self.json_model = self.model.bind(response_format={"type": "json_object"})
     
-    @traceable(name="simple_llm_invoke")
-    def invoke(self, input, config: RunnableConfig = None):
-        """Invoke the model and return response with simple token tracking."""
-        # For CLI testing, we'll use a simplified approach
-        response = self.model.invoke(input, config=config)
+    def _token_usage(self, input, response) -> list:
+        """Count token usage for an input/response pair."""
+        # Exact counts reported by the provider, when available
+        usage = getattr(response, 'usage_metadata', None)
+        if usage:
+            return [{
+                "model_name": self.model_name,
+                "input_tokens": usage.get('input_tokens', 0),
+                "output_tokens": usage.get('output_tokens', 0)
+            }]
         
-        # Simple token estimation (for demo purposes)
         input_text = ""
         if isinstance(input, list):
-            for msg in input:
-                if hasattr(msg, 'content'):
-                    input_text += str(msg.content)
+            input_text = "".join(str(msg.content) for msg in input if hasattr(msg, 'content'))
         elif isinstance(input, str):
             input_text = input
-            
-        # Very rough token estimation
-        input_tokens = len(input_text.split()) * 1.3  # Rough approximation
-        output_tokens = len(response.content.split()) * 1.3 if hasattr(response, 'content') else 0
         
-        token_usage = [{
+        # Otherwise tiktoken with the encoder cached per model (an estimate when the encoder cannot be loaded)
+        input_tokens = count_tokens(input_text, self.model_name)
+        output_tokens = count_tokens(str(response.content), self.model_name) if hasattr(response, 'content') else 0
+        
+        return [{
             "model_name": self.model_name,
-            "input_tokens": int(input_tokens),
-            "output_tokens": int(output_tokens)
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens
         }]
+    
+    def _cache_key(self, input, json_mode: bool = False) -> str:
+        """Build the response cache key of an input (a list of messages or a string)."""
+        messages = input if isinstance(input, list) else [input]
+        model_name = f"{self.model_name}:json" if json_mode else self.model_name
+        return llm_cache_key(model_name, *(str(getattr(msg, 'content', msg)) for msg in messages))
+    
+    def _cached_response(self, key: str):
+        """Return a cached (response, token_usage) pair, or None on a cache miss."""
+        cached = load_cached_response(key)
+        if cached is None:
+            return None
+        response = AIMessage(content=cached['content'], response_metadata={'from_cache': True})
+        return response, cached['token_usage']
+    
+    @traceable(name="simple_llm_invoke")
+    def invoke(self, input, config: RunnableConfig = None):
+        """Invoke the model and return response with simple token tracking."""
+        key = self._cache_key(input)
+        cached = self._cached_response(key)
+        if cached:
+            return cached
+        
+        # For CLI testing, we'll use a simplified approach
+        response = self.model.invoke(input, config=config)
+        token_usage = self._token_usage(input, response)
+        if isinstance(response.content, str):
+            store_cached_response(key, response.content, token_usage)
+        return response, token_usage
+    
+    @traceable(name="simple_llm_invoke_json")
+    def invoke_json(self, input, config: RunnableConfig = None, max_tokens: Optional[int] = None):
+        """
+        Stream the model response in JSON mode and aggregate it into one message.
+        
+        max_tokens overrides the output token limit (e.g. for batch analyses).
+        Returns the same (response, token_usage) pair as invoke.
+        """
+        key = self._cache_key(input, json_mode=True)
+        cached = self._cached_response(key)
+        if cached:
+            return cached
+        
+        # JSON mode guarantees nothing follows the object, so reading to the end of the
+        # stream costs no extra output and collects the final usage_metadata chunk
+        response = None
+        model = self.json_model if max_tokens is None else self.json_model.bind(max_tokens=max_tokens)
+        for chunk in model.stream(input, config=config):
+            response = chunk if response is None else response + chunk
+        if response is None:
+            response = AIMessage(content="")
         
-        return response, token_usage
\ No newline at end of file
+        token_usage = self._token_usage(input, response)
+        # Only cache responses that produced usable JSON
+        if extract_json_from_text(response.content) is not None:
+            store_cached_response(key, response.content, token_usage)
+        return response, token_usage
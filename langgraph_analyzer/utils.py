@@ -6,67 +6,299 @@ Utility functions for the Subsidy Analyzer
 This module contains helper functions used across the analyzer.
 """
 
+import os
 import re
+import functools
+import itertools
+import json
+import mmap
+import queue
+import atexit
 import logging
+import threading
+import multiprocessing
+from types import MappingProxyType
+from logging.handlers import QueueHandler, QueueListener
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, Tuple, Union, Mapping
+
+import PyPDF2
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import orjson
+except ImportError:  # Fall back to the stdlib json module
+    orjson = None
+
+try:
+    import pypdfium2 as pdfium
+except ImportError:  # Fall back to the pure-Python PyPDF2 extractor
+    pdfium = None
+
+# Binary buffers accepted by the PDF validators
+BytesLike = Union[bytes, bytearray, memoryview]
+
+# Background writer behind the queue-based log handler
+_log_listener: Optional[QueueListener] = None
+
+# Decoder used to parse a JSON object embedded in a longer text
+_JSON_DECODER = json.JSONDecoder()
+
+# Standard headers for API requests, built once and shared read-only
+_API_HEADERS = MappingProxyType({
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+    'Accept': 'application/json, text/plain, */*',
+    'Accept-Language': 'es-ES,es;q=0.9,en;q=0.8',
+    'Accept-Encoding': 'gzip, deflate, br',
+    'Connection': 'keep-alive',
+    'Cache-Control': 'no-cache',
+    'Pragma': 'no-cache'
+})
+
+# A subsidy record is usable once it has any of these fields
+_SUBSIDY_ID_FIELDS = frozenset({'codigo_bdns', 'bdns_code', 'source_url'})
+
+# Patterns used on every document name
+_FNAME_BAD = re.compile(r'[^\w\s-]')
+_FNAME_WS = re.compile(r'[-\s]+')
+
+# ASCII bytes _FNAME_BAD removes, for the bytes.translate fast path of clean_filename
+_FNAME_BAD_ASCII = bytes(code for code in range(128) if _FNAME_BAD.match(chr(code)))
+
+# pdfium is not thread-safe, so serialize in-process access across threads
+_PDFIUM_LOCK = threading.Lock()
+
+# Running headers/footers: lines among the first/last HEADER_FOOTER_LINES of a page that
+# repeat on at least HEADER_FOOTER_PAGE_RATIO of the pages of a long enough document
+HEADER_FOOTER_LINES = 3
+HEADER_FOOTER_PAGE_RATIO = 0.8
+MIN_PAGES_FOR_HEADER_STRIPPING = 4
+
+# PDFs longer than this are split into page ranges extracted in parallel
+PARALLEL_EXTRACTION_MIN_PAGES = 48
+PAGES_PER_EXTRACTION_TASK = 16
+
+# Extracted page texts are separated by a form feed so page boundaries survive
+PAGE_SEPARATOR = "\f"
+
+# Readers look for the %%EOF trailer within the last KiB of a PDF
+PDF_TRAILER_WINDOW = 1024
+
+# Context window of the supported models (gpt-4o, gpt-4o-mini)
+MODEL_CONTEXT_TOKENS = 128_000
+
+# Room left in the context for the answer (max_tokens) and for the rest of the
+# prompt: system message, instructions and the subsidy's API data
+PROMPT_RESERVE_TOKENS = 4_000 + 12_000
+
+# Upper bound for the PDF text sent to the LLM in one prompt; MAX_PDF_PROMPT_TOKENS
+# lowers it to cut cost or adapts it to a model with a smaller context
+MAX_PDF_PROMPT_TOKENS = int(os.getenv("MAX_PDF_PROMPT_TOKENS", MODEL_CONTEXT_TOKENS - PROMPT_RESERVE_TOKENS))
+
+# Rough size of a token, used when no tiktoken encoding is available
+CHARS_PER_TOKEN = 4
+
+# Page labels, dropped wherever they appear ("Página 3", "Pág. 3 de 10")
+_PAGE_LABEL_LINE = re.compile(r'^p[áa]g(?:ina)?\.?\s*\d+(?:\s*(?:de|/)\s*\d+)?$', re.IGNORECASE)
+
+# Bare page numbers ("3", "3 de 10", "3/10"); only dropped as the first or last line of a
+# page, since table cells (amounts, years) also sit alone on their lines
+_BARE_PAGE_NUMBER = re.compile(r'^\d{1,3}(?:\s*(?:de|/)\s*\d{1,3})?$')
+
+# Section headings of a call for applications ("Artículo 5. Plazo...", "Tercero.", "2. BENEFICIARIOS");
+# case matters so that prose lines ("3 de marzo de 2024", "primera convocatoria") are not headings
+_SECTION_HEADING = re.compile(
+    r'^(?:(?:Art[íi]culo|ART[ÍI]CULO)\s+\d+'
+    r'|(?:Primer|Segund|Tercer|Cuart|Quint|Sext|S[ée]ptim|Octav|Noven|D[ée]cim'
+    r'|PRIMER|SEGUND|TERCER|CUART|QUINT|SEXT|S[ÉE]PTIM|OCTAV|NOVEN|D[ÉE]CIM)[OAoa]\s*[.:\-–]'
+    r'|\d+(?:\.\d+)*\.?\s+[A-ZÁÉÍÓÚÑ])'
+)
+
+# Sections whose heading mentions any of these terms are relevant to the extraction
+_RELEVANT_SECTION = re.compile(
+    r'objeto|finalidad|beneficiari|requisito|gasto|presupuest|cr[ée]dito|financiaci[óo]n|cuant[íi]a|importe|'
+    r'distribuci[óo]n|plazo|solicitud|presentaci[óo]n|resoluci[óo]n|evaluaci[óo]n|criterio|documentaci[óo]n',
+    re.IGNORECASE
+)
+
+_extraction_pool: Optional[ProcessPoolExecutor] = None
+_extraction_pool_lock = threading.Lock()
+
+# Whether the current pool has finished a task; a pool that breaks before that cannot start
+# workers at all (e.g. a script without a __main__ guard), so the process pool is turned off
+_extraction_pool_ready = False
+_extraction_pool_disabled = False
 
 
 def setup_logging(log_file: str = "langgraph_subsidy_analyzer.log") -> logging.Logger:
-    """Setup logging configuration."""
+    """Setup logging configuration.
+    
+    Records are queued and written to the file/console by a background
+    listener, so log I/O never blocks the workflow threads.
+    """
+    global _log_listener
+    # Root already configured (by the host application, or by this module before a
+    # reload reset _log_listener): adding handlers again would duplicate every line
+    if _log_listener is not None or logging.getLogger().handlers:
+        return logging.getLogger(__name__)
+    
+    log_queue = queue.SimpleQueue()
+    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    handlers = [
+        logging.FileHandler(log_file, delay=True),  # Opened on the first record
+        logging.StreamHandler()
+    ]
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    
+    _log_listener = QueueListener(log_queue, *handlers)
+    _log_listener.start()
+    atexit.register(_log_listener.stop)
+    
+    # Final formatting happens in the listener's handlers
+    queue_handler = QueueHandler(log_queue)
+    queue_handler.setFormatter(logging.Formatter('%(message)s'))
     logging.basicConfig(
         level=logging.INFO,
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-        handlers=[
-            logging.FileHandler(log_file),
-            logging.StreamHandler()
-        ]
+        handlers=[queue_handler]
     )
     return logging.getLogger(__name__)
 
 
 def extract_bdns_from_url(url: str) -> Optional[str]:
     """Extract BDNS code from a URL."""
-    bdns_match = re.search(r'/(\d+)$', url)
-    if bdns_match:
-        return bdns_match.group(1)
+    _, slash, tail = url.rpartition('/')
+    # isdecimal() accepts the same characters as the regex \d
+    if slash and tail.isdecimal():
+        return tail
     return None
 
 
 def clean_filename(filename: str, max_length: int = 50) -> str:
     """Clean a filename to be filesystem-safe."""
-    # Remove special characters
-    safe_name = re.sub(r'[^\w\s-]', '', filename)
+    # Remove special characters (a C-level byte deletion for plain ASCII names)
+    if filename.isascii():
+        safe_name = filename.encode('ascii').translate(None, _FNAME_BAD_ASCII).decode('ascii')
+    else:
+        safe_name = _FNAME_BAD.sub('', filename)
     # Replace spaces and hyphens with underscores
-    safe_name = re.sub(r'[-\s]+', '_', safe_name)
+    safe_name = _FNAME_WS.sub('_', safe_name)
     # Limit length
     return safe_name[:max_length]
 
 
+@functools.lru_cache(maxsize=None)
 def create_download_directory(base_dir: str = "downloaded_files") -> Path:
-    """Create and return the download directory path."""
+    """Create (once per process) and return the download directory path."""
     download_path = Path(base_dir)
     download_path.mkdir(parents=True, exist_ok=True)
     return download_path
 
 
+def dumps_json(data: Any) -> str:
+    """Serialize data as indented JSON, keeping non-ASCII characters as-is."""
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS).decode()
+    return json.dumps(data, indent=2, ensure_ascii=False)
+
+
+def loads_json(text: Union[str, bytes]) -> Any:
+    """Parse a JSON document (raises json.JSONDecodeError on invalid input)."""
+    if orjson is not None:
+        return orjson.loads(text)  # orjson.JSONDecodeError subclasses json.JSONDecodeError
+    return json.loads(text)
+
+
+def write_json_file(path: Union[str, Path], data: Any) -> None:
+    """Write data to path as indented UTF-8 JSON."""
+    if orjson is not None:
+        Path(path).write_bytes(orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
+        return
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+
+
+def _json_span_end(text: str, start: int) -> Optional[int]:
+    """
+    Return the offset just past the '}' closing the object that opens at start.
+    
+    Braces inside JSON strings are ignored; returns None when the object is
+    never closed (e.g. a truncated response).
+    """
+    depth = 0
+    in_string = escape = False
+    for index in range(start, len(text)):
+        char = text[index]
+        if in_string:
+            if escape:
+                escape = False
+            elif char == '\\':
+                escape = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char == '{':
+            depth += 1
+        elif char == '}':
+            depth -= 1
+            if depth == 0:
+                return index + 1
+    return None
+
+
 def extract_json_from_text(text: str) -> Optional[Dict[str, Any]]:
     """Extract JSON object from text that might contain other content."""
-    # Try to find JSON in the text
-    json_match = re.search(r'\{.*\}', text, re.DOTALL)
-    if json_match:
-        import json
-        try:
-            return json.loads(json_match.group())
-        except json.JSONDecodeError:
-            return None
+    # Fast path: the response is one object, possibly wrapped in a ```json fence or prose;
+    # the outermost braces are found and parsed entirely in C
+    start, end = text.find('{'), text.rfind('}')
+    if start == -1 or end < start:
+        return None
+    try:
+        return loads_json(text[start:end + 1])
+    except json.JSONDecodeError:
+        pass
+    
+    # Several objects or stray braces: decode from each top-level '{' in turn, ignoring what follows the object
+    while start != -1:
+        next_start = start + 1
+        if not _is_nested_json_value(text, start):
+            try:
+                return _JSON_DECODER.raw_decode(text, start)[0]
+            except json.JSONDecodeError:
+                span_end = _json_span_end(text, start)
+                if span_end is not None:
+                    # Malformed but closed object: anything inside it is only a fragment
+                    next_start = span_end
+        start = text.find('{', next_start)
     return None
 
 
+def _is_nested_json_value(text: str, index: int) -> bool:
+    """Whether the '{' at index is a value inside a JSON object or array (after '"key":', ',' or '[')."""
+    index -= 1
+    while index >= 0 and text[index].isspace():
+        index -= 1
+    if index < 0:
+        return False
+    if text[index] in ',[':
+        return True
+    if text[index] != ':':
+        return False
+    
+    index -= 1
+    while index >= 0 and text[index].isspace():
+        index -= 1
+    return index >= 0 and text[index] == '"'
+
+
 def validate_subsidy_data(data: Dict[str, Any]) -> bool:
     """Validate that subsidy data contains minimum required fields."""
-    required_fields = ['codigo_bdns', 'bdns_code', 'source_url']
-    return any(field in data for field in required_fields)
+    return not _SUBSIDY_ID_FIELDS.isdisjoint(data.keys())
 
 
 def format_territorial_distribution(distribution: Dict[str, str]) -> str:
@@ -86,50 +318,322 @@ def summarize_pdf_content(pdf_texts: List[Dict[str, str]], max_chars: int = 1000
     if not pdf_texts:
         return "No PDF content available"
     
-    summary_parts = []
-    for pdf in pdf_texts[:3]:  # First 3 PDFs
-        filename = pdf.get('filename', 'Unknown')
-        text = pdf.get('text', '')
-        preview = text[:max_chars] + "..." if len(text) > max_chars else text
-        summary_parts.append(f"[{filename}]: {preview}")
+    # Previews of the first 3 PDFs; only max_chars of each text is ever copied
+    summary_parts = (
+        f"[{pdf.get('filename', 'Unknown')}]: {text[:max_chars]}{'...' if len(text) > max_chars else ''}"
+        for pdf in itertools.islice(pdf_texts, 3)
+        for text in (pdf.get('text', ''),)
+    )
     
     if len(pdf_texts) > 3:
-        summary_parts.append(f"... and {len(pdf_texts) - 3} more PDFs")
+        summary_parts = itertools.chain(summary_parts, [f"... and {len(pdf_texts) - 3} more PDFs"])
     
     return "\n\n".join(summary_parts)
 
 
-def get_api_headers() -> Dict[str, str]:
-    """Get standard headers for API requests."""
-    return {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-        'Accept': 'application/json, text/plain, */*',
-        'Accept-Language': 'es-ES,es;q=0.9,en;q=0.8',
-        'Accept-Encoding': 'gzip, deflate, br',
-        'Connection': 'keep-alive',
-        'Cache-Control': 'no-cache',
-        'Pragma': 'no-cache'
-    }
+def get_api_headers() -> Mapping[str, str]:
+    """Get standard headers for API requests (read-only; copy before modifying)."""
+    return _API_HEADERS
+
+
+def create_http_session() -> requests.Session:
+    """Create a requests session with pooled keep-alive connections and retries."""
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=16,
+        pool_maxsize=32,
+        max_retries=Retry(
+            total=3,
+            backoff_factor=0.3,
+            status_forcelist=[429, 500, 502, 503, 504],
+            raise_on_status=False  # Let callers inspect the final status code
+        )
+    )
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.headers.update(get_api_headers())
+    return session
+
+
+def has_pdf_trailer(tail: BytesLike) -> bool:
+    """Check that the last bytes of a PDF contain the %%EOF marker (i.e. it is not truncated)."""
+    return b'%%EOF' in bytes(tail[-PDF_TRAILER_WINDOW:])
 
 
-def validate_pdf_content(content: bytes) -> bool:
-    """Validate that content is actually a PDF."""
+def validate_pdf_content(content: BytesLike, strict: bool = False) -> bool:
+    """
+    Validate that content is actually a PDF.
+    
+    Only the magic number is checked, so the first chunk of a download is
+    enough; with strict=True the complete content must also end with the
+    %%EOF trailer. content may be a memoryview: only the checked bytes are copied.
+    """
     # Check PDF magic number
-    return content.startswith(b'%PDF')
+    if bytes(content[:5]) != b'%PDF-':
+        return False
+    return not strict or has_pdf_trailer(content)
+
+
+def _get_extraction_pool() -> Optional[ProcessPoolExecutor]:
+    """Return the process pool used for page-level text extraction (None when turned off)."""
+    global _extraction_pool, _extraction_pool_ready
+    with _extraction_pool_lock:
+        if _extraction_pool is None and not _extraction_pool_disabled:
+            # Workers start from a clean interpreter instead of forking a process
+            # that is running download/logging threads and in-process pdfium calls
+            if 'forkserver' in multiprocessing.get_all_start_methods():
+                context = multiprocessing.get_context('forkserver')
+                # Preload only this module in the server, not the caller's __main__
+                context.set_forkserver_preload(['langgraph_analyzer.utils'])
+            else:
+                context = multiprocessing.get_context('spawn')
+            _extraction_pool = ProcessPoolExecutor(max_workers=os.cpu_count(), mp_context=context)
+            _extraction_pool_ready = False
+        return _extraction_pool
+
+
+def _discard_extraction_pool(pool: ProcessPoolExecutor) -> None:
+    """Drop a broken extraction pool so the next extraction starts a new one."""
+    global _extraction_pool, _extraction_pool_disabled
+    with _extraction_pool_lock:
+        if _extraction_pool is pool:
+            _extraction_pool = None
+            if not _extraction_pool_ready:
+                _extraction_pool_disabled = True
+                logging.getLogger(__name__).warning(
+                    "PDF extraction workers failed to start; extracting in-process from now on "
+                    "(scripts using the analyzer need an `if __name__ == \"__main__\":` guard)"
+                )
+    pool.shutdown(wait=False)
+
+
+def _extract_page_range(pdf_path: str, start: int, stop: int) -> str:
+    """Extract the text of pages [start, stop) of a PDF with pdfium (runs in a worker process)."""
+    pdf = pdfium.PdfDocument(pdf_path)
+    try:
+        return PAGE_SEPARATOR.join(pdf[i].get_textpage().get_text_range() for i in range(start, stop))
+    finally:
+        pdf.close()
+
+
+def _extract_with_pypdf2(pdf_path: str) -> str:
+    """Extract the text of a PDF with PyPDF2 (in a worker process, or in-process as a fallback)."""
+    with open(pdf_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as pdf_map:
+        pdf_reader = PyPDF2.PdfReader(pdf_map)
+        parts = [page.extract_text() or "" for page in pdf_reader.pages]
+    
+    return PAGE_SEPARATOR.join(parts)
+
+
+def extract_pdf_text(pdf_path: Union[str, Path]) -> str:
+    """
+    Extract the text of every page of a PDF file.
+    
+    Extraction runs in a shared process pool, so several PDFs are processed
+    on separate cores without contending for the GIL; long PDFs are further
+    split into page ranges.
+    """
+    global _extraction_pool_ready
+    pdf_path = str(pdf_path)
+    pool = _get_extraction_pool()
+    if pool is None:
+        return _extract_with_pypdf2(pdf_path)
+    
+    try:
+        text = _extract_in_pool(pool, pdf_path)
+    except BrokenProcessPool:
+        # A worker died (e.g. pdfium crashed on this file): later extractions get a fresh
+        # pool and this one is retried in-process with PyPDF2, which cannot crash the process
+        _discard_extraction_pool(pool)
+        return _extract_with_pypdf2(pdf_path)
+    
+    _extraction_pool_ready = True
+    return text
+
+
+def _extract_in_pool(pool: ProcessPoolExecutor, pdf_path: str) -> str:
+    """Extract the text of a PDF on the given process pool."""
+    if pdfium is None:
+        return pool.submit(_extract_with_pypdf2, pdf_path).result()
+    
+    with _PDFIUM_LOCK:
+        pdf = pdfium.PdfDocument(pdf_path)
+        try:
+            page_count = len(pdf)
+        finally:
+            pdf.close()
+    
+    # Short documents are a single task; long ones are split into ranges of pages
+    step = page_count if page_count < PARALLEL_EXTRACTION_MIN_PAGES else PAGES_PER_EXTRACTION_TASK
+    starts = range(0, page_count, max(step, 1))
+    stops = [min(start + step, page_count) for start in starts]
+    parts = pool.map(_extract_page_range, [pdf_path] * len(stops), starts, stops)
+    return PAGE_SEPARATOR.join(parts)
+
+
+def _strip_repeated_lines(text: str) -> str:
+    """Drop running headers/footers (edge lines repeated on nearly every page) and page numbers."""
+    pages = [page.splitlines() for page in text.split(PAGE_SEPARATOR)]
+    
+    # Headers and footers sit in the first and last few lines of a page; table rows and
+    # amounts repeated in the body of several pages are never candidates
+    page_edges = []
+    for lines in pages:
+        filled = [index for index, line in enumerate(lines) if line.strip()]
+        page_edges.append(set(filled[:HEADER_FOOTER_LINES] + filled[-HEADER_FOOTER_LINES:]))
+    
+    repeated = set()
+    if len(pages) >= MIN_PAGES_FOR_HEADER_STRIPPING:
+        line_counts: Dict[str, int] = {}
+        for lines, edges in zip(pages, page_edges):
+            for line in {lines[index].strip() for index in edges}:
+                line_counts[line] = line_counts.get(line, 0) + 1
+        repeated = {line for line, count in line_counts.items() if count >= len(pages) * HEADER_FOOTER_PAGE_RATIO}
+    
+    kept = []
+    for lines, edges in zip(pages, page_edges):
+        outermost = {min(edges), max(edges)} if edges else set()
+        for index, line in enumerate(lines):
+            stripped = line.strip()
+            if stripped and ((index in edges and stripped in repeated) or _PAGE_LABEL_LINE.match(stripped)
+                             or (index in outermost and _BARE_PAGE_NUMBER.match(stripped))):
+                continue
+            kept.append(line)
+    return "\n".join(kept)
+
+
+def _keep_relevant_sections(text: str) -> str:
+    """Keep the preamble (title, issuing body) and the sections with a relevant heading."""
+    # Split into sections at heading lines; sections[0] is the preamble
+    sections: List[List[str]] = [[]]
+    for line in text.splitlines():
+        if _SECTION_HEADING.match(line.strip()):
+            sections.append([])
+        sections[-1].append(line)
+    
+    if len(sections) == 1:
+        return text
+    
+    kept = [sections[0]] + [section for section in sections[1:] if _RELEVANT_SECTION.search(section[0])]
+    return "\n".join("\n".join(section) for section in kept)
+
+
+@functools.lru_cache(maxsize=None)
+def _get_token_encoding(model_name: str):
+    """
+    Return the tiktoken encoding of a model.
+    
+    Returns None (so counts fall back to a characters-per-token estimate) when
+    tiktoken is missing or its BPE file cannot be loaded, e.g. on offline hosts
+    where the first-use download fails; the result, failure included, is cached
+    so the download is attempted once per model.
+    """
+    # Imported on first use: loading tiktoken is only paid when tokens are counted
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    try:
+        try:
+            return tiktoken.encoding_for_model(model_name)
+        except KeyError:  # Non-OpenAI models: approximate with the current OpenAI encoding
+            return tiktoken.get_encoding("o200k_base")
+    except Exception as e:
+        logging.getLogger(__name__).warning(
+            "Could not load the tiktoken encoding for %s (%s); estimating token counts", model_name, e
+        )
+        return None
+
+
+def count_tokens(text: str, model_name: str) -> int:
+    """Count (or estimate, without a tiktoken encoding) the tokens of a text."""
+    encoding = _get_token_encoding(model_name)
+    if encoding is None:
+        return len(text) // CHARS_PER_TOKEN
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_to_tokens(text: str, max_tokens: int, model_name: str) -> str:
+    """Cut a text down to at most max_tokens tokens."""
+    encoding = _get_token_encoding(model_name)
+    if encoding is None:
+        return text[:max_tokens * CHARS_PER_TOKEN]
+    tokens = encoding.encode(text, disallowed_special=())
+    return text if len(tokens) <= max_tokens else encoding.decode(tokens[:max_tokens])
+
+
+def fit_pdf_texts_to_budget(texts: List[str], model_name: str,
+                            max_tokens: int = MAX_PDF_PROMPT_TOKENS) -> Tuple[List[str], int, int]:
+    """
+    Shrink the extracted texts of several PDFs to a shared prompt token budget.
+    
+    Texts within the budget are sent whole. Otherwise running headers/footers
+    and page numbers are removed first and, if the documents are still over
+    budget, documents smaller than an even share are kept whole and the
+    remaining budget is split between the larger ones, which keep only their
+    relevant sections and are then cut to their share.
+    
+    Returns:
+        The fitted texts, and the token counts before and after fitting
+    """
+    counts = [count_tokens(text, model_name) for text in texts]
+    total = sum(counts)
+    if total <= max_tokens:
+        return [text.replace(PAGE_SEPARATOR, "\n") for text in texts], total, total
+    
+    texts = [_strip_repeated_lines(text) for text in texts]
+    counts = [count_tokens(text, model_name) for text in texts]
+    if sum(counts) <= max_tokens:
+        return texts, total, sum(counts)
+    
+    # Hand out the budget from the smallest document up, so what a small one
+    # does not use goes to the larger ones
+    remaining = max_tokens
+    order = sorted(range(len(texts)), key=counts.__getitem__)
+    for position, index in enumerate(order):
+        share = remaining // (len(order) - position)
+        if counts[index] > share:
+            texts[index] = truncate_to_tokens(_keep_relevant_sections(texts[index]), share, model_name)
+            counts[index] = count_tokens(texts[index], model_name)
+        remaining -= counts[index]
+    
+    return texts, total, sum(counts)
+
+
+def _merge_lists(primary: List[Any], secondary: List[Any]) -> List[Any]:
+    """Concatenate two lists, dropping duplicates while preserving order."""
+    # One side is usually empty (fallback analyses): nothing to deduplicate against
+    if not secondary:
+        return primary
+    if not primary:
+        return list(secondary)
+    
+    try:
+        return list(dict.fromkeys(itertools.chain(primary, secondary)))
+    except TypeError:  # Unhashable items (e.g. dicts): fall back to equality checks
+        combined: List[Any] = []
+        for item in itertools.chain(primary, secondary):
+            if item not in combined:
+                combined.append(item)
+        return combined
 
 
 def merge_analysis_results(primary: Dict[str, Any], secondary: Dict[str, Any]) -> Dict[str, Any]:
     """Merge two analysis results, preferring primary values when available."""
     merged = primary.copy()
     
-    for key, value in secondary.items():
-        if key not in merged or merged[key] is None or merged[key] == "No especificado":
-            merged[key] = value
-        elif isinstance(value, dict) and isinstance(merged[key], dict):
-            merged[key] = merge_analysis_results(merged[key], value)
-        elif isinstance(value, list) and isinstance(merged[key], list):
-            # Combine lists and remove duplicates
-            combined = merged[key] + value
-            merged[key] = list(dict.fromkeys(combined))  # Remove duplicates while preserving order
-    
-    return merged
\ No newline at end of file
+    # Walk nested dicts with an explicit stack instead of recursing
+    pending = [(merged, secondary)]
+    while pending:
+        target, source = pending.pop()
+        for key, value in source.items():
+            current = target.get(key)
+            if current is None or current == "No especificado":
+                target[key] = value
+            elif isinstance(value, dict) and isinstance(current, dict):
+                target[key] = current.copy()
+                pending.append((target[key], value))
+            elif isinstance(value, list) and isinstance(current, list) and value:
+                target[key] = _merge_lists(current, value)
+    
+    return merged
@@ -1,14 +1,57 @@
-from langchain_openai import ChatOpenAI
-from langchain_deepseek import ChatDeepSeek
 from langchain_core.runnables.config import RunnableConfig
-from langchain_google_genai import ChatGoogleGenerativeAI
 import os
-import tiktoken
-from langchain_huggingface import HuggingFaceEndpoint, ChatHuggingFace
 from dotenv import load_dotenv
 from langsmith import traceable
+from langchain_core.messages import AIMessage
 load_dotenv()
 
+
+# Backend packages are imported inside their factory, so only the one in use is loaded
+def _openrouter_model(model_name: str):
+    from langchain_openai import ChatOpenAI
+    return ChatOpenAI(
+        model_name=model_name,
+        openai_api_key=os.getenv("OPENROUTER_API_KEY"),
+        openai_api_base=os.getenv("OPENROUTER_BASE_URL"),
+    )
+
+
+def _openai_model(model_name: str):
+    from langchain_openai import ChatOpenAI
+    return ChatOpenAI(
+        model_name=model_name,
+        openai_api_key=os.getenv("OPENAI_API_KEY"),
+        openai_api_base=os.getenv("OPENAI_API_BASE"),
+    )
+
+
+def _gemini_model(model_name: str):
+    from langchain_google_genai import ChatGoogleGenerativeAI
+    return ChatGoogleGenerativeAI(
+        google_api_key=os.getenv("GOOGLE_API_KEY"),
+        model=model_name,
+    )
+
+
+def _huggingface_model(model_name: str):
+    from langchain_huggingface import HuggingFaceEndpoint, ChatHuggingFace
+    return ChatHuggingFace(
+        llm=HuggingFaceEndpoint(
+            repo_id=model_name,
+            task="text-generation"
+        ),
+        verbose=True
+    )
+
+
+def _deepseek_model(model_name: str):
+    from langchain_deepseek import ChatDeepSeek
+    return ChatDeepSeek(
+        model=model_name,
+        api_key=os.getenv("DEEPSEEK_API_KEY")
+    )
+
+
 # Language Models
 class LanguageModel:
     _openrouter_language_models = [
@@ -16,7 +59,7 @@ class LanguageModel:
         "meta-llama/llama-3.3-70b-instruct",
         "qwen/qwen-2.5-72b-instruct",
         "deepseek/deepseek-chat-v3-0324:free",
-        "google/gemini-2.0-flash-001"
+        "google/gemini-2.0-flash-001",
         "anthropic/claude-3-haiku",
         "mistralai/mistral-medium"
     ]
@@ -48,51 +91,30 @@ class LanguageModel:
     ]
     
                     
+    # Model name -> factory building its chat model
+    _model_factories = {
+        **dict.fromkeys(_openrouter_language_models, _openrouter_model),
+        **dict.fromkeys(_openai_language_models, _openai_model),
+        **dict.fromkeys(_gemini_language_models, _gemini_model),
+        **dict.fromkeys(_huggingface_language_models, _huggingface_model),
+        **dict.fromkeys(_deepseek_language_models, _deepseek_model),
+    }
+
     def __init__(self, model_name: str):
         self.model_name = model_name  # Store model name
-        if model_name in self._openrouter_language_models:
-            self.model = ChatOpenAI(
-                model_name=model_name,
-                openai_api_key=os.getenv("OPENROUTER_API_KEY"),
-                openai_api_base=os.getenv("OPENROUTER_BASE_URL"),
-            )
-        elif model_name in self._openai_language_models:
-            self.model = ChatOpenAI(
-                model_name=model_name,
-                openai_api_key=os.getenv("OPENAI_API_KEY"),
-                openai_api_base=os.getenv("OPENAI_API_BASE"),
-            )
-        elif model_name in self._gemini_language_models:
-            self.model = ChatGoogleGenerativeAI(
-                google_api_key=os.getenv("GOOGLE_API_KEY"),
-                model=model_name,
-            )
-        elif model_name in self._huggingface_language_models:
-            self.model = ChatHuggingFace(
-                llm=HuggingFaceEndpoint(
-                    repo_id=model_name,
-                    task="text-generation"
-                ),
-                verbose=True
-            )
-        elif model_name in self._deepseek_language_models:
-            self.model = ChatDeepSeek(
-                model=model_name,
-                api_key=os.getenv("DEEPSEEK_API_KEY")            
-                )
-        else:
+        factory = self._model_factories.get(model_name)
+        if factory is None:
             raise ValueError(f"Model {model_name} not found")
+        self.model = factory(model_name)
 
     def _count_tokens(self, text: str) -> int:
-        """Counts tokens using tiktoken with a default encoding."""
-        # Using cl100k_base as a common default. Specific models might need different encodings.
-        try:
-            encoding = tiktoken.get_encoding("cl100k_base") 
-            return len(encoding.encode(text))
-        except Exception as e:
-            print(f"Could not count tokens: {e}")
-            # Fallback or error handling - returning 0 or raising might be options
-            return 0 
+        """Counts tokens using tiktoken, with the model's encoder loaded once and cached.
+
+        Only used when the provider does not return usage_metadata.
+        """
+        # Imported on first use: langgraph_analyzer.utils pulls in the PDF and HTTP stack
+        from langgraph_analyzer.utils import count_tokens
+        return count_tokens(text, self.model_name)
 
     @traceable(name="language_model_invoke_with_tokens")
     def invoke(self, input, config: RunnableConfig | None = None) -> dict:
@@ -107,31 +129,47 @@ class LanguageModel:
             A dictionary containing the model's response and token usage.
             e.g., {"response": AIMessage(...), "token_usage": {"input_tokens": 100, "output_tokens": 50}}
         """
-        input_tokens = 0
-        # LangChain inputs can be dicts or lists of messages. Handle list case.
-        if isinstance(input, list):
-             for message in input:
-                 # Assuming messages have a 'content' attribute
-                 if hasattr(message, 'content') and isinstance(message.content, str):
-                     input_tokens += self._count_tokens(message.content)
-                 # Handle cases where content might be structured (e.g., vision models) - basic string conversion for now
-                 elif hasattr(message, 'content'):
-                      try:
-                          input_tokens += self._count_tokens(str(message.content))
-                      except Exception:
-                          # Add more robust handling if needed
-                          pass 
-        elif isinstance(input, str): # Handle plain string input
-            input_tokens += self._count_tokens(input)
-        # Add handling for other potential input types if necessary
+        # Imported on first call, so `from llms import LanguageModel` stays cheap
+        from langgraph_analyzer.cache import llm_cache_key, load_cached_response, store_cached_response
+
+        # Identical requests (same model, prompt version and messages) reuse the stored response
+        messages = input if isinstance(input, list) else [input]
+        cache_key = llm_cache_key(self.model_name, *(str(getattr(m, 'content', m)) for m in messages))
+        cached = load_cached_response(cache_key)
+        if cached is not None:
+            return AIMessage(content=cached['content'], response_metadata={'from_cache': True}), cached['token_usage']
 
         # Invoke the actual model
         response = self.model.invoke(input, config=config)
 
-        # Count output tokens
-        output_tokens = 0
-        if hasattr(response, 'content') and isinstance(response.content, str):
-             output_tokens = self._count_tokens(response.content)
+        # Providers report exact counts in usage_metadata; avoid re-encoding the whole prompt
+        usage = getattr(response, 'usage_metadata', None)
+        if usage:
+            input_tokens = usage.get('input_tokens', 0)
+            output_tokens = usage.get('output_tokens', 0)
+        else:
+            input_tokens = 0
+            # LangChain inputs can be dicts or lists of messages. Handle list case.
+            if isinstance(input, list):
+                 for message in input:
+                     # Assuming messages have a 'content' attribute
+                     if hasattr(message, 'content') and isinstance(message.content, str):
+                         input_tokens += self._count_tokens(message.content)
+                     # Handle cases where content might be structured (e.g., vision models) - basic string conversion for now
+                     elif hasattr(message, 'content'):
+                          try:
+                              input_tokens += self._count_tokens(str(message.content))
+                          except Exception:
+                              # Add more robust handling if needed
+                              pass 
+            elif isinstance(input, str): # Handle plain string input
+                input_tokens += self._count_tokens(input)
+            # Add handling for other potential input types if necessary
+
+            # Count output tokens
+            output_tokens = 0
+            if hasattr(response, 'content') and isinstance(response.content, str):
+                 output_tokens = self._count_tokens(response.content)
 
         token_usage = [
             {
@@ -141,4 +179,7 @@ class LanguageModel:
             }
         ]
 
+        if isinstance(response.content, str):
+            store_cached_response(cache_key, response.content, token_usage)
+
         return response, token_usage
\ No newline at end of file
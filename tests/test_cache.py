@@ -0,0 +1,57 @@
+"""
+Tests for the Subsidy Analyzer caches
+=====================================
+"""
+
+import sys
+import os
+
+# Add the project root to the path for absolute imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+from langgraph_analyzer import cache
+
+
+@pytest.fixture(autouse=True)
+def isolated_cache(monkeypatch, tmp_path):
+    """Keep cache entries of a test in its own directory."""
+    monkeypatch.setattr(cache, "CACHE_ENABLED", True)
+    monkeypatch.setattr(cache, "CACHE_DIR", tmp_path)
+    monkeypatch.setattr(cache, "LLM_CACHE_PATH", tmp_path / "llm_responses.sqlite")
+    cache._ensure_cache_dir.cache_clear()
+    yield
+    cache._ensure_cache_dir.cache_clear()
+
+
+def test_llm_cache_round_trip():
+    key = cache.llm_cache_key("gpt-4o-mini", "system", "prompt")
+    usage = [{"model_name": "gpt-4o-mini", "input_tokens": 10, "output_tokens": 5}]
+
+    assert cache.load_cached_response(key) is None
+    cache.store_cached_response(key, '{"a": 1}', usage)
+    assert cache.load_cached_response(key) == {'content': '{"a": 1}', 'token_usage': usage}
+
+
+def test_llm_cache_key_depends_on_model_and_contents():
+    key = cache.llm_cache_key("gpt-4o-mini", "system", "prompt")
+
+    assert key != cache.llm_cache_key("gpt-4o", "system", "prompt")
+    assert key != cache.llm_cache_key("gpt-4o-mini", "systemprompt")
+
+
+def test_llm_cache_ignores_expired_entries():
+    key = cache.llm_cache_key("gpt-4o-mini", "prompt")
+    cache.store_cached_response(key, "old", [], ttl=-1)
+
+    assert cache.load_cached_response(key) is None
+
+
+def test_invalidate_llm_cache_by_prompt_version():
+    key = cache.llm_cache_key("gpt-4o-mini", "prompt")
+    cache.store_cached_response(key, "cached", [])
+
+    assert cache.invalidate_llm_cache("v0") == 0
+    assert cache.invalidate_llm_cache(cache.PROMPT_VERSION) == 1
+    assert cache.load_cached_response(key) is None
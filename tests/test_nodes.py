@@ -0,0 +1,116 @@
+"""
+Tests for the Subsidy Analyzer nodes
+====================================
+"""
+
+import sys
+import os
+
+# Add the project root to the path for absolute imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+from langgraph_analyzer import cache, nodes
+
+
+PDF_BODY = b"%PDF-1.4\n" + b"0" * 200_000 + b"\n%%EOF\n"
+
+
+class FakeResponse:
+    """Streamed requests response serving a fixed body."""
+
+    def __init__(self, body: bytes = b"", status_code: int = 200, headers=None):
+        self.body = body
+        self.status_code = status_code
+        self.headers = headers or {}
+
+    def iter_content(self, chunk_size: int):
+        for start in range(0, len(self.body), chunk_size):
+            yield self.body[start:start + chunk_size]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+class FakeSession:
+    """requests.Session stand-in answering every GET with the response registered for its URL."""
+
+    def __init__(self, responses):
+        self.responses = responses
+        self.requests = []
+
+    def get(self, url, stream=False, timeout=None, headers=None):
+        self.requests.append((url, headers or {}))
+        return self.responses[url]
+
+
+@pytest.fixture(autouse=True)
+def isolated_cache(monkeypatch, tmp_path):
+    """Keep cache entries of a test in its own directory."""
+    monkeypatch.setattr(cache, "CACHE_ENABLED", True)
+    monkeypatch.setattr(cache, "CACHE_DIR", tmp_path / "cache")
+    cache._ensure_cache_dir.cache_clear()
+    yield
+    cache._ensure_cache_dir.cache_clear()
+
+
+def _pdf_info(doc_id, name="Bases reguladoras de la convocatoria"):
+    return {'url': f"https://example.org/document/{doc_id}", 'name': name, 'id': doc_id}
+
+
+def test_download_pdf_saves_a_valid_pdf(tmp_path):
+    session = FakeSession({"https://example.org/document/1": FakeResponse(PDF_BODY, headers={'ETag': '"v1"'})})
+
+    download = nodes._download_pdf(session, _pdf_info(1), "845133", tmp_path)
+
+    assert download['etag'] == '"v1"'
+    assert open(download['path'], 'rb').read() == PDF_BODY
+    assert not list(tmp_path.glob("*.part"))
+
+
+def test_download_pdf_refuses_html_error_pages(tmp_path):
+    session = FakeSession({"https://example.org/document/1": FakeResponse(b"<html>Error</html>")})
+
+    assert nodes._download_pdf(session, _pdf_info(1), "845133", tmp_path) is None
+    assert not list(tmp_path.iterdir())
+
+
+def test_download_pdf_drops_truncated_files(tmp_path):
+    session = FakeSession({"https://example.org/document/1": FakeResponse(PDF_BODY[:-10])})
+
+    assert nodes._download_pdf(session, _pdf_info(1), "845133", tmp_path) is None
+    assert not list(tmp_path.iterdir())
+
+
+def test_download_pdf_keeps_same_named_documents_apart(tmp_path):
+    """Documents sharing a name (or its first 50 characters) get separate files."""
+    other_body = PDF_BODY.replace(b"0", b"1")
+    session = FakeSession({
+        "https://example.org/document/1": FakeResponse(PDF_BODY),
+        "https://example.org/document/2": FakeResponse(other_body)
+    })
+
+    first = nodes._download_pdf(session, _pdf_info(1), "845133", tmp_path)
+    second = nodes._download_pdf(session, _pdf_info(2), "845133", tmp_path)
+
+    assert first['path'] != second['path']
+    assert open(first['path'], 'rb').read() == PDF_BODY
+    assert open(second['path'], 'rb').read() == other_body
+
+
+def test_download_pdf_revalidates_cached_entry_with_etag(tmp_path):
+    """A cached PDF with an ETag is revalidated, and reused on 304 Not Modified."""
+    pdf_path = tmp_path / "cached.pdf"
+    pdf_path.write_bytes(PDF_BODY)
+    cache.store_cached_pdf("845133", 1, "texto extraído", pdf_path, etag='"v1"')
+    session = FakeSession({"https://example.org/document/1": FakeResponse(status_code=304)})
+
+    download = nodes._download_pdf(session, _pdf_info(1), "845133", tmp_path)
+
+    assert session.requests[0][1] == {'If-None-Match': '"v1"'}
+    assert download == {'filename': "Bases reguladoras de la convocatoria",
+                        'text': "texto extraído", 'path': str(pdf_path)}
@@ -0,0 +1,130 @@
+"""
+Tests for the Subsidy Analyzer utilities
+=======================================
+"""
+
+import sys
+import os
+import types
+
+# Add the project root to the path for absolute imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langgraph_analyzer import utils
+from langgraph_analyzer.utils import (
+    extract_json_from_text, count_tokens, truncate_to_tokens, fit_pdf_texts_to_budget,
+    CHARS_PER_TOKEN, PAGE_SEPARATOR
+)
+
+
+def test_extract_json_ignores_fragments_of_malformed_object():
+    """A closed but malformed object must not yield one of its nested objects."""
+    text = '{"identificacion": {"organismo_emisor": "X"}, "detalles": {"beneficiarios": []},}'
+    assert extract_json_from_text(text) is None
+
+
+def test_extract_json_skips_stray_brace_before_object():
+    """An unbalanced '{' in prose must not hide the JSON object that follows it."""
+    text = 'Usa { para abrir el bloque. {"identificacion": {"organismo_emisor": "X"}}'
+    assert extract_json_from_text(text) == {"identificacion": {"organismo_emisor": "X"}}
+
+
+def test_extract_json_rejects_truncated_object():
+    """A truncated response must not yield its last complete nested object."""
+    text = '{"identificacion": {"organismo_emisor": "X"}, "detalles": '
+    assert extract_json_from_text(text) is None
+
+
+def test_count_tokens_falls_back_to_estimate_when_encoding_fails(monkeypatch):
+    """A tiktoken load failure (e.g. the BPE download on an offline host) degrades to the estimate."""
+    def fail(*args, **kwargs):
+        raise OSError("Failed to resolve 'openaipublic.blob.core.windows.net'")
+    
+    monkeypatch.setitem(sys.modules, 'tiktoken', types.SimpleNamespace(encoding_for_model=fail, get_encoding=fail))
+    utils._get_token_encoding.cache_clear()
+    try:
+        text = "x" * 40
+        assert count_tokens(text, "gpt-4o-mini") == 40 // CHARS_PER_TOKEN
+        assert truncate_to_tokens(text, 5, "gpt-4o-mini") == "x" * (5 * CHARS_PER_TOKEN)
+    finally:
+        utils._get_token_encoding.cache_clear()
+
+
+def _paged_document(page_count: int) -> str:
+    """A document with a running header/footer and a table row repeated in the body of every page."""
+    return PAGE_SEPARATOR.join(
+        f"BOLETÍN OFICIAL DE LA PROVINCIA\nConvocatoria de ayudas\nApartado {page}\n"
+        f"Territorio\nImporte\nMadrid\n150000\nTexto del apartado {page}\n"
+        f"Firmado electrónicamente\nPágina {page} de {page_count}"
+        for page in range(1, page_count + 1)
+    )
+
+
+def test_strip_repeated_lines_keeps_table_rows_repeated_across_pages():
+    """Only header/footer lines at the page edges are stripped, not body rows that repeat."""
+    stripped = utils._strip_repeated_lines(_paged_document(6))
+    
+    assert "BOLETÍN OFICIAL DE LA PROVINCIA" not in stripped
+    assert "Firmado electrónicamente" not in stripped
+    assert "Página 3 de 6" not in stripped
+    assert stripped.count("Madrid\n150000") == 6
+    assert stripped.count("Territorio\nImporte") == 6
+
+
+def test_strip_repeated_lines_keeps_short_documents_whole():
+    """Lines shared by the pages of a short document are not taken for headers."""
+    stripped = utils._strip_repeated_lines(_paged_document(3))
+    assert stripped.count("BOLETÍN OFICIAL DE LA PROVINCIA") == 3
+
+
+def test_strip_repeated_lines_keeps_bare_numbers_inside_pages():
+    """Amounts alone on their line are not mistaken for page numbers."""
+    assert utils._strip_repeated_lines("Madrid\n150000\nBarcelona\n200000\nTotal") == \
+        "Madrid\n150000\nBarcelona\n200000\nTotal"
+
+
+def test_fit_pdf_texts_to_budget_sends_texts_within_budget_whole(monkeypatch):
+    """Texts under the budget are not trimmed (page breaks become newlines)."""
+    monkeypatch.setattr(utils, "_get_token_encoding", lambda model_name: None)
+    texts = [f"Página 1{PAGE_SEPARATOR}Madrid\n150000", "Objeto de la ayuda"]
+    
+    fitted, original, sent = fit_pdf_texts_to_budget(texts, "gpt-4o-mini", max_tokens=1000)
+    
+    assert fitted == ["Página 1\nMadrid\n150000", "Objeto de la ayuda"]
+    assert original == sent
+
+
+def test_fit_pdf_texts_to_budget_keeps_small_documents_and_trims_large_ones(monkeypatch):
+    """The budget goes to small documents first; only the large one is cut."""
+    monkeypatch.setattr(utils, "_get_token_encoding", lambda model_name: None)
+    small = "Beneficiarios: pymes de Madrid."
+    large = "Texto de la convocatoria. " * 400
+    budget = 200
+    
+    fitted, original, sent = fit_pdf_texts_to_budget([large, small], "gpt-4o-mini", max_tokens=budget)
+    
+    assert fitted[1] == small
+    assert len(fitted[0]) < len(large)
+    assert sent <= budget < original
+
+
+def test_merge_lists_deduplicates_in_order_and_handles_unhashable_items():
+    """List reducers keep the first occurrence of every item, dicts included."""
+    assert utils._merge_lists(["pymes", "autónomos"], ["autónomos", "ONG"]) == ["pymes", "autónomos", "ONG"]
+    assert utils._merge_lists([], ["ONG"]) == ["ONG"]
+    assert utils._merge_lists([{"a": 1}], [{"a": 1}, {"b": 2}]) == [{"a": 1}, {"b": 2}]
+
+
+def test_merge_analysis_results_fills_missing_values_from_secondary():
+    """Primary values win; placeholders, missing keys and nested dicts are filled from secondary."""
+    primary = {"titulo": "Ayudas", "plazo": "No especificado", "detalles": {"beneficiarios": ["pymes"]}}
+    secondary = {"titulo": "Otro", "plazo": "30 días", "detalles": {"beneficiarios": ["ONG"], "finalidad": "I+D"}}
+    
+    merged = utils.merge_analysis_results(primary, secondary)
+    
+    assert merged == {
+        "titulo": "Ayudas",
+        "plazo": "30 días",
+        "detalles": {"beneficiarios": ["pymes", "ONG"], "finalidad": "I+D"}
+    }
+    assert primary["detalles"] == {"beneficiarios": ["pymes"]}